@@ -0,0 +1,56 @@
+"""
+Load-test the same read traffic against the sync gunicorn workers (Procfile)
+and the ASGI entry point (src/asgi.py) with the same number of processes.
+
+    $ python benchmarks/async_vs_sync.py --characters 10000 --workers 2 --concurrency 32
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import loadgen  # noqa: E402
+from seed import ROOT, create_seeded_database  # noqa: E402
+
+# the reads asgi.py serves itself, everything else is the same Flask code in both runs
+PATHS = ["/favorites?limit=50", "/favorites/1", "/favorites/2", "/user?limit=50", "/user/1", "/user/2"]
+
+def serve(command, env, base_url, concurrency, duration):
+    with loadgen.server(command, env, base_url, cwd=ROOT):
+        loadgen.run(base_url, PATHS, concurrency=concurrency, duration=1.0)  # warm up
+        return loadgen.run(base_url, PATHS, concurrency=concurrency, duration=duration)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--characters", type=int, default=10000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    database_uri = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+    create_seeded_database(database_uri, args.characters)
+    # compare the database paths, not the response cache
+    env = dict(os.environ, DATABASE_URL=database_uri, CACHE_ENABLED="0")
+    base_url = f"http://127.0.0.1:{args.port}"
+    bind = f"127.0.0.1:{args.port}"
+
+    results = {
+        "sync_gunicorn": serve([sys.executable, "-m", "gunicorn", "wsgi", "--chdir", "./src/",
+                                "--workers", str(args.workers), "--bind", bind],
+                               env, base_url, args.concurrency, args.duration),
+        "async_uvicorn": serve([sys.executable, "-m", "uvicorn", "asgi:application", "--app-dir", "src",
+                                "--workers", str(args.workers), "--host", "127.0.0.1", "--port", str(args.port),
+                                "--log-level", "warning"],
+                               env, base_url, args.concurrency, args.duration),
+    }
+    print(json.dumps({"characters": args.characters, "workers": args.workers,
+                      "concurrency": args.concurrency, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
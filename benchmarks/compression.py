@@ -0,0 +1,51 @@
+"""
+Size and time of compressing a /characters page with gzip and brotli, and the
+cost of a cached GET with compression (compressed once, then served from the
+cache) against one compressed on every request.
+
+    $ pipenv run python benchmarks/compression.py --characters 5000 --limit 1000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from seed import create_seeded_database  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--characters", type=int, default=5000)
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    app, _ = create_seeded_database(f"sqlite:///{tempfile.mkdtemp()}/compression.db", args.characters)
+    from compression import brotli
+    compressor = app.extensions["compressor"]
+    cache = app.extensions["response_cache"]
+    client = app.test_client()
+    path = f"/characters?limit={args.limit}"
+
+    body = client.get(path, headers={"Accept-Encoding": "identity"}).get_data()
+    print(f"{path}: {len(body)} bytes uncompressed")
+    encodings = ["gzip"] + (["br"] if brotli is not None else [])
+    if brotli is None:
+        print("brotli is not installed, only gzip is measured")
+    for encoding in encodings:
+        compressed = compressor.compress_bytes(body, encoding)
+        seconds = min(timeit.repeat(lambda: compressor.compress_bytes(body, encoding), number=1, repeat=args.repeat))
+        print(f"{encoding:>5}: {len(compressed)} bytes ({len(compressed) / len(body):.1%}), {seconds * 1000:.2f} ms")
+
+    for enabled in (False, True):
+        cache.enabled = enabled
+        client.get(path, headers={"Accept-Encoding": "gzip"})
+        seconds = min(timeit.repeat(lambda: client.get(path, headers={"Accept-Encoding": "gzip"}),
+                                    number=1, repeat=args.repeat))
+        print(f"GET with gzip, cache {'on' if enabled else 'off'}: {seconds * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
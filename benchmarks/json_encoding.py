@@ -0,0 +1,58 @@
+"""
+Serialize + encode time of the /characters list with the stdlib and the orjson
+JSON providers.
+
+    $ pipenv run python benchmarks/json_encoding.py --rows 5000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+    from app import app
+    from flask.json.provider import DefaultJSONProvider
+    from json_provider import OrjsonProvider, orjson
+    from models import db, Characters, Planets, Starships
+
+    with app.app_context():
+        db.create_all()
+        planet = Planets(planet_name="Tatooine", gravity="1 standard", diameter=10465, rotation_period=23)
+        starship = Starships(starship_name="X-wing", model="T-65 X-wing", starship_class="Starfighter", length="12.5", crew="1")
+        db.session.add_all([planet, starship])
+        db.session.add_all([
+            Characters(character_name=f"Character {i}", height=172, mass=77, hair_color="blond",
+                       skin_color="fair", planet=planet, starship=starship)
+            for i in range(args.rows)
+        ])
+        db.session.commit()
+
+        characters = Characters.query.all()
+        body = {"characters": [character.serialize() for character in characters]}
+
+        providers = {"stdlib": DefaultJSONProvider(app)}
+        if orjson is not None:
+            providers["orjson"] = OrjsonProvider(app)
+        else:
+            print("orjson is not installed, only the stdlib provider is measured")
+
+        serialize = min(timeit.repeat(lambda: [c.serialize() for c in characters], number=1, repeat=args.repeat))
+        print(f"serialize {args.rows} characters: {serialize * 1000:.2f} ms")
+        for name, provider in providers.items():
+            encode = min(timeit.repeat(lambda: provider.response(body).get_data(), number=1, repeat=args.repeat))
+            print(f"{name:>7} encode: {encode * 1000:.2f} ms, serialize+encode: {(serialize + encode) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
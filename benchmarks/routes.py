@@ -0,0 +1,293 @@
+"""
+Benchmark every route of src/app.py against a seeded SQLite database.
+
+Each route is driven through the Flask test client (reads and writes, with the
+SQL statement count of every request) and, for the GET routes, over HTTP with
+the local load generator against gunicorn. Results are written as JSON so two
+runs can be compared:
+
+    $ python benchmarks/routes.py --scale 100k --output before.json
+    $ python benchmarks/routes.py --scale 100k --output after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import loadgen  # noqa: E402
+from seed import ROOT, create_seeded_database, insert_rows, planet_row, starship_row, character_row, \
+    favorite_row, user_row  # noqa: E402
+
+SCALES = {"1k": 1000, "100k": 100000, "1m": 1000000}
+# served by Flask itself, not by app.py
+SKIPPED_ENDPOINTS = {"static"}
+
+
+class Fixtures:
+    # Untimed setup for the write routes: rows to update or delete are created
+    # before the request under measurement is sent.
+    def __init__(self, db, counts):
+        self.db = db
+        self.counts = counts
+        self.rng = random.Random(7)
+        self.serial = 0
+
+    def next(self):
+        self.serial += 1
+        return self.serial
+
+    def create(self, model, amount=1):
+        from models import Planets, Starships, Characters, Favorites, User
+        factories = {
+            Planets: lambda i: planet_row(self.rng, i),
+            Starships: lambda i: starship_row(self.rng, i),
+            Characters: lambda i: character_row(self.rng, i, self.counts["planets"], self.counts["starships"]),
+            Favorites: lambda i: favorite_row(self.rng, i, self.counts["characters"], self.counts["planets"],
+                                              self.counts["starships"]),
+            User: lambda i: user_row(self.rng, i),
+        }
+        rows = [factories[model](f"bench-{self.next()}") for _ in range(amount)]
+        insert_rows(self.db, model, rows)
+        self.db.session.commit()
+        last_id = self.db.session.query(self.db.func.max(model.id)).scalar()
+        return list(range(last_id - amount + 1, last_id + 1))
+
+    def write_job(self, body):
+        from flask import current_app
+        return current_app.extensions["write_queue"].enqueue("create_user", body)
+
+
+def route_cases(fixtures):
+    # endpoint (or endpoint_variant) -> function(i) returning (method, path, json body)
+    from models import Planets, Starships, Characters, Favorites, User
+    rng = fixtures.rng
+    counts = fixtures.counts
+
+    def some(name):
+        return rng.randint(1, counts[name])
+
+    def planet():
+        return {"planet_name": f"Bench {fixtures.next()}", "gravity": "1 standard", "diameter": 10465,
+                "rotation_period": 23}
+
+    def starship():
+        return {"starship_name": f"Bench {fixtures.next()}", "model": "T-65", "starship_class": "Starfighter",
+                "length": "12.5", "crew": "1"}
+
+    def character():
+        return {"character_name": f"Bench {fixtures.next()}", "hair_color": "blond", "height": 172, "mass": 77,
+                "skin_color": "fair", "planet_id": some("planets")}
+
+    def favorite_items(amount=20):
+        return [{"type": item_type, "id": some(f"{item_type}s")}
+                for item_type in (rng.choice(("character", "planet", "starship")) for _ in range(amount))]
+
+    def ids(name, amount=50):
+        return ",".join(str(some(name)) for _ in range(amount))
+
+    def user():
+        serial = fixtures.next()
+        return {"username": f"bench{serial}", "email": f"bench{serial}@example.com", "password": "secret"}
+
+    return {
+        "sitemap": lambda i: ("GET", "/", None),
+        "get_routes": lambda i: ("GET", "/routes", None),
+        "healthz": lambda i: ("GET", "/healthz", None),
+        "get_write_job": lambda i: ("GET", f"/writes/{fixtures.write_job(user())}", None),
+        "readyz": lambda i: ("GET", "/readyz", None),
+        "get_cache_stats": lambda i: ("GET", "/cache/stats", None),
+        "get_pool_stats": lambda i: ("GET", "/pool/stats", None),
+        "get_metrics": lambda i: ("GET", "/metrics", None),
+        "search": lambda i: ("GET", f"/search?q={rng.choice(['a', 'lu', 'sky', 'x wing', 'star'])}", None),
+
+        "get_users": lambda i: ("GET", "/user", None),
+        "get_users_by_ids": lambda i: ("GET", f"/user?ids={ids('users')}", None),
+        "get_single_user": lambda i: ("GET", f"/user/{some('users')}", None),
+        "post_user": lambda i: ("POST", "/user", user()),
+        "modify_user": lambda i: ("PUT", "/user", {"id": some("users"), **user()}),
+        "delete_user": lambda i: ("DELETE", f"/user/{fixtures.create(User)[0]}", None),
+        "get_user_favorites": lambda i: ("GET", f"/user/{some('users')}/favorites", None),
+        "check_user_favorites": lambda i: ("GET", f"/user/{some('users')}/favorites/check?"
+                                                  f"characters={','.join(str(some('characters')) for _ in range(50))}"
+                                                  f"&planets={some('planets')}&starships={some('starships')}", None),
+        "post_user_favorites": lambda i: ("POST", f"/user/{some('users')}/favorites", favorite_items()),
+        "delete_user_favorites": lambda i: ("DELETE", f"/user/{some('users')}/favorites", favorite_items()),
+
+        "get_characters": lambda i: ("GET", "/characters", None),
+        "get_characters_by_ids": lambda i: ("GET", f"/characters?ids={ids('characters')}", None),
+        "get_single_character": lambda i: ("GET", f"/characters/{some('characters')}", None),
+        "post_character": lambda i: ("POST", "/characters", character()),
+        "modify_character": lambda i: ("PUT", "/characters", {"id": some("characters"), **character()}),
+        "delete_character": lambda i: ("DELETE", f"/characters/{fixtures.create(Characters)[0]}", None),
+        "post_characters_bulk": lambda i: ("POST", "/characters/bulk", [character() for _ in range(100)]),
+        "modify_characters_bulk": lambda i: ("PUT", "/characters/bulk",
+                                             [{"id": some("characters"), **character()} for _ in range(100)]),
+        "delete_characters_bulk": lambda i: ("DELETE", "/characters/bulk", fixtures.create(Characters, 100)),
+
+        "get_planets": lambda i: ("GET", "/planets", None),
+        "get_planets_by_ids": lambda i: ("GET", f"/planets?ids={ids('planets')}", None),
+        "get_single_planet": lambda i: ("GET", f"/planets/{some('planets')}", None),
+        "post_planets": lambda i: ("POST", "/planets", planet()),
+        "modify_planets": lambda i: ("PUT", "/planets", {"id": some("planets"), **planet()}),
+        "delete_planets": lambda i: ("DELETE", f"/planets/{fixtures.create(Planets)[0]}", None),
+        "post_planets_bulk": lambda i: ("POST", "/planets/bulk", [planet() for _ in range(100)]),
+        "modify_planets_bulk": lambda i: ("PUT", "/planets/bulk",
+                                          [{"id": some("planets"), **planet()} for _ in range(100)]),
+        "delete_planets_bulk": lambda i: ("DELETE", "/planets/bulk", fixtures.create(Planets, 100)),
+
+        "get_starships": lambda i: ("GET", "/starships", None),
+        "get_starships_by_ids": lambda i: ("GET", f"/starships?ids={ids('starships')}", None),
+        "get_single_starship": lambda i: ("GET", f"/starships/{some('starships')}", None),
+        "post_starships": lambda i: ("POST", "/starships", starship()),
+        "modify_starships": lambda i: ("PUT", "/starships", {"id": some("starships"), **starship()}),
+        "delete_starships": lambda i: ("DELETE", f"/starships/{fixtures.create(Starships)[0]}", None),
+        "post_starships_bulk": lambda i: ("POST", "/starships/bulk", [starship() for _ in range(100)]),
+        "modify_starships_bulk": lambda i: ("PUT", "/starships/bulk",
+                                            [{"id": some("starships"), **starship()} for _ in range(100)]),
+        "delete_starships_bulk": lambda i: ("DELETE", "/starships/bulk", fixtures.create(Starships, 100)),
+
+        "get_favorites": lambda i: ("GET", "/favorites", None),
+        "get_single_favorite": lambda i: ("GET", f"/favorites/{some('favorites')}", None),
+        "post_favorites": lambda i: ("POST", "/favorites", {"list_name": f"bench {fixtures.next()}",
+                                                            "character_id": some("characters"),
+                                                            "planet_id": some("planets"),
+                                                            "starship_id": some("starships")}),
+        "update_favorite": lambda i: ("PUT", f"/favorites/{some('favorites')}", {"list_name": f"bench {fixtures.next()}"}),
+        "delete_favorite": lambda i: ("DELETE", f"/favorites/{fixtures.create(Favorites)[0]}", None),
+    }
+
+
+def app_endpoints(app):
+    return sorted({rule.endpoint for rule in app.url_map.iter_rules()
+                   if rule.endpoint not in SKIPPED_ENDPOINTS and not rule.rule.startswith("/admin")})
+
+def bench_test_client(app, db, cases, iterations):
+    from sqlalchemy import event
+    statements = [0]
+
+    def count(*args):
+        statements[0] += 1
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", count)
+    client = app.test_client()
+    results = {}
+    try:
+        for endpoint, case in cases.items():
+            latencies = []
+            queries = []
+            failures = 0
+            for i in range(iterations):
+                with app.app_context():
+                    method, path, body = case(i)
+                statements[0] = 0
+                started = time.perf_counter()
+                response = client.open(path, method=method, json=body)
+                latencies.append(time.perf_counter() - started)
+                queries.append(statements[0])
+                if response.status_code >= 400:
+                    failures += 1
+            result = loadgen.summarize(latencies, failures, sum(latencies))
+            result["queries_per_request"] = round(sum(queries) / len(queries), 2)
+            result["max_queries"] = max(queries)
+            results[endpoint] = result
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    return results
+
+def bench_http(app, cases, database_uri, concurrency, duration, port):
+    # only the GET routes, so the dataset is the same for every run
+    paths = {}
+    with app.app_context():
+        for endpoint, case in cases.items():
+            method, path, _ = case(0)
+            if method == "GET":
+                paths[endpoint] = [case(i)[1] for i in range(50)]
+
+    env = dict(os.environ, DATABASE_URL=database_uri)
+    base_url = f"http://127.0.0.1:{port}"
+    command = [sys.executable, "-m", "gunicorn", "wsgi", "--chdir", "./src/", "--bind", f"127.0.0.1:{port}",
+               "--workers", "2"]
+    results = {}
+    with loadgen.server(command, env, base_url, cwd=ROOT):
+        for endpoint, endpoint_paths in paths.items():
+            results[endpoint] = loadgen.run(base_url, endpoint_paths, concurrency=concurrency, duration=duration)
+    return results
+
+def compare(current, baseline_path, threshold):
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = []
+    for mode in ("test_client", "http"):
+        for endpoint, result in current.get(mode, {}).items():
+            before = baseline.get(mode, {}).get(endpoint)
+            if not before:
+                continue
+            for metric in ("p50_ms", "p99_ms", "queries_per_request"):
+                if metric in result and before.get(metric):
+                    change = (result[metric] - before[metric]) / before[metric]
+                    if change > threshold:
+                        regressions.append(f"{mode} {endpoint} {metric}: {before[metric]} -> {result[metric]} "
+                                           f"(+{change:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", default="1k", help="1k, 100k, 1m or a number of characters")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--http", action="store_true", help="also load-test the GET routes over HTTP")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=3.0)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--cache", action="store_true", help="keep the response cache on")
+    parser.add_argument("--write-behind", action="store_true",
+                        help="queue the write-behind routes (202) instead of committing in the request")
+    parser.add_argument("--output")
+    parser.add_argument("--compare", help="earlier --output file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative slowdown reported by --compare")
+    args = parser.parse_args()
+
+    characters = SCALES[args.scale.lower()] if args.scale.lower() in SCALES else int(args.scale)
+    if not args.cache:
+        os.environ["CACHE_ENABLED"] = "0"
+    directory = tempfile.mkdtemp()
+    database_uri = f"sqlite:///{directory}/routes.db"
+    os.environ["WRITE_BEHIND_PATH"] = f"{directory}/write_behind.sqlite3"
+    if args.write_behind:
+        os.environ["WRITE_BEHIND_ENABLED"] = "1"
+    app, counts = create_seeded_database(database_uri, characters)
+    from models import db
+
+    fixtures = Fixtures(db, counts)
+    cases = route_cases(fixtures)
+    missing = [endpoint for endpoint in app_endpoints(app) if endpoint not in cases]
+    if missing:
+        raise SystemExit(f"No benchmark case for: {', '.join(missing)}")
+
+    report = {"scale": characters, "rows": counts, "iterations": args.iterations,
+              "test_client": bench_test_client(app, db, cases, args.iterations)}
+    if args.http:
+        report["http"] = bench_http(app, cases, database_uri, args.concurrency, args.duration, args.port)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    print(output)
+
+    if args.compare:
+        regressions = compare(report, args.compare, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
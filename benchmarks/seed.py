@@ -0,0 +1,104 @@
+"""
+Synthetic Star Wars data for the benchmarks.
+
+    $ python benchmarks/seed.py sqlite:////tmp/bench.db --characters 100000
+"""
+import argparse
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+PLANETS = ["Tatooine", "Alderaan", "Yavin", "Hoth", "Dagobah", "Bespin", "Endor", "Naboo", "Coruscant", "Kamino"]
+STARSHIPS = ["X-wing", "Y-wing", "TIE Fighter", "Millennium Falcon", "Star Destroyer", "Slave I", "A-wing"]
+CLASSES = ["Starfighter", "Light freighter", "Star Destroyer", "Patrol craft", "Assault starfighter"]
+NAMES = ["Luke", "Leia", "Han", "Chewbacca", "Obi-Wan", "Yoda", "Lando", "Padme", "Anakin", "Rey", "Finn", "Poe"]
+COLORS = ["blond", "brown", "black", "white", "none", "auburn", "fair", "light", "green", "gold"]
+
+def planet_row(rng, i):
+    return {"planet_name": f"{rng.choice(PLANETS)} {i}", "gravity": f"{rng.randint(1, 3)} standard",
+            "diameter": rng.randint(1000, 120000), "rotation_period": rng.randint(10, 40)}
+
+def starship_row(rng, i):
+    return {"starship_name": f"{rng.choice(STARSHIPS)} {i}"[:30], "model": f"Model {rng.randint(1, 99)}",
+            "starship_class": rng.choice(CLASSES), "length": str(rng.randint(5, 2000)),
+            "crew": str(rng.randint(1, 5000))}
+
+def character_row(rng, i, planets, starships):
+    return {"character_name": f"{rng.choice(NAMES)} {i}"[:20], "height": rng.randint(60, 230),
+            "mass": rng.randint(20, 180), "hair_color": rng.choice(COLORS), "skin_color": rng.choice(COLORS),
+            "planet_id": rng.randint(1, planets), "starship_id": rng.randint(1, starships) if rng.random() < 0.7 else None}
+
+def favorite_row(rng, i, characters, planets, starships):
+    return {"list_name": f"list {i}", "character_id": rng.randint(1, characters),
+            "planet_id": rng.randint(1, planets), "starship_id": rng.randint(1, starships)}
+
+def user_row(rng, i):
+    return {"username": f"user{i}", "email": f"user{i}@example.com", "password": "secret", "is_active": True}
+
+def user_favorite_rows(rng, user_id, counts, amount=10):
+    # distinct (type, id) pairs for one user
+    items = set()
+    while len(items) < amount:
+        item_type = rng.choice(("character", "planet", "starship"))
+        items.add((item_type, rng.randint(1, counts[f"{item_type}s"])))
+    return [{"user_id": user_id, "item_type": item_type, "item_id": item_id} for item_type, item_id in sorted(items)]
+
+def insert_rows(db, model, rows, batch_size=5000):
+    # executemany batches through Core, which is what makes the 1M row scale practical
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            db.session.execute(model.__table__.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(model.__table__.insert(), batch)
+
+def seed(db, characters=1000, random_seed=42):
+    # The other tables are sized from the number of characters
+    from models import Planets, Starships, Characters, Favorites, User, UserFavorite
+    from cards import build_missing_cards
+
+    rng = random.Random(random_seed)
+    counts = {"characters": characters}
+    for name in ("planets", "starships", "favorites", "users"):
+        counts[name] = max(1, characters // 10)
+
+    insert_rows(db, Planets, (planet_row(rng, i) for i in range(counts["planets"])))
+    insert_rows(db, Starships, (starship_row(rng, i) for i in range(counts["starships"])))
+    insert_rows(db, Characters, (character_row(rng, i, counts["planets"], counts["starships"])
+                                 for i in range(characters)))
+    insert_rows(db, Favorites, (favorite_row(rng, i, characters, counts["planets"], counts["starships"])
+                                for i in range(counts["favorites"])))
+    insert_rows(db, User, (user_row(rng, i) for i in range(counts["users"])))
+    insert_rows(db, UserFavorite, (row for user_id in range(1, counts["users"] + 1)
+                                   for row in user_favorite_rows(rng, user_id, counts)))
+    db.session.commit()
+    build_missing_cards()
+    db.session.commit()
+    return counts
+
+def create_seeded_database(database_uri, characters):
+    # Imports the app with DATABASE_URL pointing at database_uri, recreates the
+    # tables and seeds them. Returns the Flask app and the row counts.
+    os.environ["DATABASE_URL"] = database_uri
+    from app import app, search_backend
+    from models import db
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        counts = seed(db, characters)
+        search_backend.ensure_ready()
+    return app, counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("database_uri")
+    parser.add_argument("--characters", type=int, default=1000)
+    args = parser.parse_args()
+    create_seeded_database(args.database_uri, args.characters)
@@ -0,0 +1,70 @@
+"""
+Cold start of a worker in each admin mode: the time to import src/app.py in a
+fresh interpreter, the time to its first API response, and (lazy mode) what
+the first /admin/ request costs. Every number is the median of --runs fresh
+processes.
+
+    $ python benchmarks/startup.py --runs 7
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from seed import ROOT  # noqa: E402
+
+MODES = {
+    "admin_eager": {"ADMIN_MODE": "eager"},
+    "admin_lazy": {"ADMIN_MODE": "lazy"},
+    "api_only": {"API_ONLY": "1"},
+}
+
+# runs in the child process, prints one JSON line
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+from app import app, db
+imported = time.perf_counter()
+with app.app_context():
+    db.create_all()
+client = app.test_client()
+client.get("/planets?limit=1")
+first_request = time.perf_counter()
+result = {"import_ms": (imported - started) * 1000, "first_request_ms": (first_request - started) * 1000,
+          "modules": len(sys.modules)}
+if app.config["ADMIN_MODE"] == "lazy":
+    admin_started = time.perf_counter()
+    client.get("/admin/")
+    result["first_admin_request_ms"] = (time.perf_counter() - admin_started) * 1000
+print(json.dumps(result))
+"""
+
+def measure(env, runs):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", PROBE], cwd=os.path.join(ROOT, "src"), env=env,
+                                check=True, capture_output=True, text=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {key: round(statistics.median(sample[key] for sample in samples), 1) for key in samples[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    database_uri = f"sqlite:///{tempfile.mkdtemp()}/startup.db"
+    results = {}
+    for name, settings in MODES.items():
+        env = {key: value for key, value in os.environ.items() if key not in ("ADMIN_MODE", "API_ONLY")}
+        env.update(DATABASE_URL=database_uri, **settings)
+        results[name] = measure(env, args.runs)
+    print(json.dumps({"runs": args.runs, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
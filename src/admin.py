@@ -1,9 +1,16 @@
 import os
-from flask_admin import Admin
-from models import db, User, Favorites, Planets, Characters, Starships
-from flask_admin.contrib.sqla import ModelView
+import threading
+from flask import Flask
+from models import db, User, Favorites, Planets, Characters, Starships, UserFavorite
+
+ADMIN_MODES = ("eager", "lazy", "off")
 
 def setup_admin(app):
+    # flask_admin (and the WTForms scaffolding of every view) is only imported
+    # when an admin is actually built
+    from flask_admin import Admin
+    from flask_admin.contrib.sqla import ModelView
+
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
     admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
@@ -15,6 +22,60 @@ def setup_admin(app):
     admin.add_view(ModelView(Planets, db.session)) 
     admin.add_view(ModelView(Starships, db.session))
     admin.add_view(ModelView(Favorites, db.session))
+    admin.add_view(ModelView(UserFavorite, db.session))
 
     # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+    # admin.add_view(ModelView(YourModelName, db.session))
+
+
+class LazyAdmin:
+    # WSGI middleware for ADMIN_MODE=lazy: requests under /admin are sent to a
+    # second Flask app with the same config, created on the first such request.
+    # A separate app is needed because Flask doesn't accept new routes once the
+    # API app has served a request. API requests only pay one prefix check.
+    def __init__(self, app, prefix="/admin"):
+        self.app = app
+        self.prefix = prefix
+        self.wsgi_app = app.wsgi_app
+        self.admin_app = None
+        self.lock = threading.Lock()
+        app.wsgi_app = self
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        if path == self.prefix or path.startswith(self.prefix + "/"):
+            return self.get_admin_app()(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+    def get_admin_app(self):
+        if self.admin_app is None:
+            with self.lock:
+                if self.admin_app is None:
+                    admin_app = Flask(self.app.import_name)
+                    admin_app.config.update(self.app.config)
+                    db.init_app(admin_app)
+                    # one pool per process: the admin uses the API app's engine
+                    # (already set up by setup_engine) instead of the second one
+                    # init_app made, which /readyz and the pool metrics don't see
+                    with self.app.app_context():
+                        api_engines = dict(db.engines)
+                    with admin_app.app_context():
+                        for engine in db.engines.values():
+                            engine.dispose()
+                        db.engines.clear()
+                        db.engines.update(api_engines)
+                    setup_admin(admin_app)
+                    self.admin_app = admin_app
+        return self.admin_app
+
+
+def init_admin(app):
+    # ADMIN_MODE: "eager" builds the admin at startup, "lazy" on the first
+    # /admin request, "off" never (API-only workers)
+    mode = app.config.get("ADMIN_MODE", "eager")
+    if mode not in ADMIN_MODES:
+        raise ValueError(f"ADMIN_MODE must be one of {', '.join(ADMIN_MODES)}")
+    if mode == "eager":
+        setup_admin(app)
+    elif mode == "lazy":
+        LazyAdmin(app)
@@ -3,16 +3,32 @@ This module takes care of starting the API Server, Loading the DB and Adding the
 """
 import os
 from flask import Flask, request, jsonify, url_for
-from flask_migrate import Migrate
-from flask_swagger import swagger
+import click
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
-from admin import setup_admin
-from models import db, User, Favorites, Planets, Characters, Starships
+from sqlalchemy.orm.exc import StaleDataError
+from utils import APIException, RouteIndex, versioned, setup_query_counter, keyset_page, filter_query, wants_stream, stream_ndjson, check_if_match, ids_arg, get_many
+from admin import init_admin
+from models import db, User, Favorites, Planets, Characters, Starships, CharacterCard, UserFavorite
+from cache import ResponseCache, LRUCache
+from ratelimit import RateLimiter, LocalBucketStore
+from compression import Compressor
+from idempotency import idempotent
+from bulk import get_bulk_body, bulk_create, bulk_update, bulk_delete
+from json_provider import select_json_provider
+from fields import select_fields
+from engine import engine_options, setup_engine, pool_status
+from metrics import RequestMetrics
+from health import ReadinessProbe
+from writebehind import WriteQueue
+from cards import cards_enabled, get_character_card, refresh_character_cards, refresh_planet_cards, refresh_starship_cards, build_missing_cards, setup_card_events
+from search import tokenize, create_search_backend, include_object
+from favorites import parse_items, add_favorites, remove_favorites, membership_args, favorite_membership, forget_favorites, forget_user_favorites
+from schemas import user_schema, user_update_schema, character_schema, planet_schema, starship_schema, favorite_schema
 #from models import Person
 
 app = Flask(__name__)
 app.url_map.strict_slashes = False
+select_json_provider(app)
 
 db_url = os.getenv("DATABASE_URL")
 if db_url is not None:
@@ -20,485 +36,762 @@ if db_url is not None:
 else:
     app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-MIGRATE = Migrate(app, db)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+app.config['MAX_QUERIES_PER_REQUEST'] = os.getenv("MAX_QUERIES_PER_REQUEST")
+app.config['PAGE_SIZE'] = int(os.getenv("PAGE_SIZE", 100))
+app.config['MAX_PAGE_SIZE'] = int(os.getenv("MAX_PAGE_SIZE", 1000))
+app.config['STREAM_BATCH_SIZE'] = int(os.getenv("STREAM_BATCH_SIZE", 500))
+app.config['CACHE_ENABLED'] = os.getenv("CACHE_ENABLED", "1") == "1"
+app.config['CACHE_TTL'] = int(os.getenv("CACHE_TTL", 60))
+app.config['BULK_MAX_ITEMS'] = int(os.getenv("BULK_MAX_ITEMS", 10000))
+app.config['BULK_BATCH_SIZE'] = int(os.getenv("BULK_BATCH_SIZE", 1000))
+app.config['PROFILE_SLOW_REQUESTS_MS'] = os.getenv("PROFILE_SLOW_REQUESTS_MS")
+app.config['PROFILE_DIR'] = os.getenv("PROFILE_DIR", "/tmp/profiles")
+app.config['CHARACTER_CARDS'] = os.getenv("CHARACTER_CARDS", "1") == "1"
+app.config['SEARCH_BACKEND'] = os.getenv("SEARCH_BACKEND", "auto")
+app.config['SEARCH_PAGE_SIZE'] = int(os.getenv("SEARCH_PAGE_SIZE", 20))
+app.config['SEARCH_REFRESH_SECONDS'] = int(os.getenv("SEARCH_REFRESH_SECONDS", 60))
+app.config['RATE_LIMIT_ENABLED'] = os.getenv("RATE_LIMIT_ENABLED", "0") == "1"
+app.config['RATE_LIMIT_RATE'] = float(os.getenv("RATE_LIMIT_RATE", 10))
+app.config['RATE_LIMIT_BURST'] = float(os.getenv("RATE_LIMIT_BURST", 50))
+app.config['RATE_LIMIT_COSTS'] = os.getenv("RATE_LIMIT_COSTS")
+app.config['RATE_LIMIT_ROUTES'] = os.getenv("RATE_LIMIT_ROUTES")
+app.config['RATE_LIMIT_TRUST_PROXY'] = os.getenv("RATE_LIMIT_TRUST_PROXY", "0") == "1"
+app.config['COMPRESS_ENABLED'] = os.getenv("COMPRESS_ENABLED", "1") == "1"
+app.config['COMPRESS_MIN_SIZE'] = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+app.config['COMPRESS_LEVEL'] = int(os.getenv("COMPRESS_LEVEL", 6))
+app.config['COMPRESS_BR_QUALITY'] = int(os.getenv("COMPRESS_BR_QUALITY", 4))
+app.config['IDEMPOTENCY_TTL'] = int(os.getenv("IDEMPOTENCY_TTL", 86400))
+app.config['IDEMPOTENCY_LEASE'] = int(os.getenv("IDEMPOTENCY_LEASE", 60))
+app.config['READY_CACHE_SECONDS'] = float(os.getenv("READY_CACHE_SECONDS", 1))
+app.config['READY_TIMEOUT_MS'] = int(os.getenv("READY_TIMEOUT_MS", 500))
+app.config['READY_MAX_POOL_SATURATION'] = float(os.getenv("READY_MAX_POOL_SATURATION", 1))
+app.config['WRITE_BEHIND_ENABLED'] = os.getenv("WRITE_BEHIND_ENABLED", "0") == "1"
+app.config['WRITE_BEHIND_PATH'] = os.getenv("WRITE_BEHIND_PATH")
+app.config['WRITE_BEHIND_MAX_PENDING'] = int(os.getenv("WRITE_BEHIND_MAX_PENDING", 10000))
+app.config['WRITE_BEHIND_BATCH_SIZE'] = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", 100))
+app.config['WRITE_BEHIND_LEASE_SECONDS'] = float(os.getenv("WRITE_BEHIND_LEASE_SECONDS", 60))
+app.config['WRITE_BEHIND_RETENTION'] = float(os.getenv("WRITE_BEHIND_RETENTION", 3600))
+app.config['WRITE_BEHIND_WORKER'] = os.getenv("WRITE_BEHIND_WORKER", "thread")
+# API_ONLY=1: no admin and no migrations outside of the CLI, for workers that only serve the API
+app.config['API_ONLY'] = os.getenv("API_ONLY", "0") == "1"
+app.config['ADMIN_MODE'] = "off" if app.config['API_ONLY'] else os.getenv("ADMIN_MODE", "lazy")
+
+# Migrate pulls in alembic; API-only workers only need it for the `flask db` commands
+if not app.config['API_ONLY'] or click.get_current_context(silent=True) is not None:
+    from flask_migrate import Migrate
+    MIGRATE = Migrate(app, db, include_object=include_object)
 db.init_app(app)
 CORS(app)
-setup_admin(app)
+init_admin(app)
+setup_engine(app, db)
+setup_card_events(db)
+setup_query_counter(app, db)
+
+cache = ResponseCache(LRUCache(max_entries=int(os.getenv("CACHE_MAX_ENTRIES", 1024))))
+cache.init_app(app)
+
+compressor = Compressor()
+compressor.init_app(app)
+
+metrics = RequestMetrics()
+metrics.init_app(app)
+
+# registered after the metrics so rejected requests are still measured
+limiter = RateLimiter(LocalBucketStore(max_keys=int(os.getenv("RATE_LIMIT_MAX_CLIENTS", 10000))))
+limiter.init_app(app)
+metrics.add_collector(lambda: [
+    ("api_cache_hits_total", "counter", "Response cache hits.", [("", cache.hits)]),
+    ("api_cache_misses_total", "counter", "Response cache misses.", [("", cache.misses)]),
+    ("api_cache_not_modified_total", "counter", "Conditional requests answered with 304.", [("", cache.not_modified)]),
+])
+metrics.add_collector(lambda: [
+    ("api_rate_limited_total", "counter", "Requests rejected with 429.",
+     [(f'endpoint="{endpoint}"', count) for endpoint, count in sorted(limiter.limited.items())]),
+])
+POOL_COUNTERS = ("connects", "invalidated", "checkouts", "wait_seconds_total")
+metrics.add_collector(lambda: [
+    (f"api_db_pool_{name}", "counter" if name in POOL_COUNTERS else "gauge",
+     f"Connection pool {name.replace('_', ' ')}.", [("", value)])
+    for name, value in pool_status(db.engine).items() if isinstance(value, (int, float))
+])
+
+search_backend = create_search_backend(app, db, cache)
+
+write_queue = WriteQueue()
+write_queue.init_app(app)
+metrics.add_collector(lambda: [
+    ("api_write_behind_jobs", "gauge", "Write-behind jobs in the queue file by state.",
+     [(f'state="{state}"', count) for state, count in sorted(write_queue.counts().items())]),
+    ("api_write_behind_applied_total", "counter", "Write-behind jobs applied by this process.", [("", write_queue.applied)]),
+    ("api_write_behind_failed_total", "counter", "Write-behind jobs that failed in this process.", [("", write_queue.failed)]),
+    ("api_write_behind_rejected_total", "counter", "Writes rejected with 503 because the queue was full.",
+     [("", write_queue.rejected)]),
+] if write_queue.enabled else [])
+
+# fills character_cards for characters written before the read model existed
+@app.cli.command("build-character-cards")
+def build_character_cards_command():
+    build_missing_cards()
+    db.session.commit()
+
+# creates (or reuses) the full-text index and fills it from the current rows
+@app.cli.command("build-search-index")
+def build_search_index_command():
+    search_backend.ensure_ready()
+
+# applies write-behind jobs in the foreground, for WRITE_BEHIND_WORKER=off web processes
+@app.cli.command("write-behind-worker")
+def write_behind_worker_command():
+    write_queue.run()
 
-# Handle/serialize errors like a JSON object
+# Handle/serialize errors like a JSON object, encoded by the same provider as every other response
 @app.errorhandler(APIException)
 def handle_invalid_usage(error):
     return jsonify(error.to_dict()), error.status_code
 
-# generate sitemap with all your endpoints
+# the row changed between our read and our write (version check in the UPDATE/DELETE)
+@app.errorhandler(StaleDataError)
+def handle_stale_data(error):
+    db.session.rollback()
+    return jsonify({"message": "This item was modified by another request"}), 409
+
+# hit/miss counters of the GET response cache
+@app.route('/cache/stats', methods=['GET'])
+@limiter.cost(0)
+def get_cache_stats():
+    return jsonify(cache.stats()), 200
+
+# connection pool usage and checkout wait times
+@app.route('/pool/stats', methods=['GET'])
+@limiter.cost(0)
+def get_pool_stats():
+    return jsonify(pool_status(db.engine)), 200
+
+# per-endpoint latency, SQL statements and DB time in the Prometheus text format
+@app.route('/metrics', methods=['GET'])
+@limiter.cost(0)
+def get_metrics():
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+# prefix search over character, planet and starship names, best matches first
+@app.route('/search', methods=['GET'])
+@limiter.cost(2)
+@cache.cached("characters", "planets", "starships")
+def search():
+    tokens = tokenize(request.args.get("q", ""))
+    if not tokens:
+        raise APIException("q must contain at least one word", status_code=400)
+    max_limit = app.config['MAX_PAGE_SIZE']
+    limit = request.args.get("limit", app.config['SEARCH_PAGE_SIZE'], type=int)
+    offset = request.args.get("offset", 0, type=int)
+    if limit < 1 or limit > max_limit:
+        raise APIException(f"limit must be between 1 and {max_limit}", status_code=400)
+    if offset < 0:
+        raise APIException("offset must be 0 or more", status_code=400)
+
+    results = search_backend.search(tokens, limit + 1, offset)
+    next_url = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_url = url_for("search", **dict(request.args.to_dict(), limit=limit, offset=offset + limit))
+    response_body = {
+        "msg": "Hello, this is your GET /search response",
+        "results": results,
+        "next": next_url
+    }
+    return jsonify(response_body), 200
+
+readiness = ReadinessProbe(db)
+readiness.init_app(app)
+
+# liveness: the process answers, nothing else is touched
+@app.route('/healthz', methods=['GET'])
+@limiter.cost(0)
+def healthz():
+    return jsonify({"status": "ok"}), 200
+
+# readiness: the database answers a SELECT 1 and the pool has room, 503 otherwise
+@app.route('/readyz', methods=['GET'])
+@limiter.cost(0)
+def readyz():
+    result = readiness.check()
+    return jsonify(result), 200 if result["ready"] else 503
+
+# generate sitemap with all your endpoints, built once and served from memory
+route_index = RouteIndex(app)
+
 @app.route('/')
+@limiter.cost(0)
 def sitemap():
-    return generate_sitemap(app)
+    return route_index.response("html")
+
+# every route with its methods and path parameters, as JSON
+@app.route('/routes', methods=['GET'])
+@limiter.cost(0)
+def get_routes():
+    return route_index.response("json")
+
+# state of a write accepted with 202 (WRITE_BEHIND_ENABLED=1)
+@app.route('/writes/<int:job_id>', methods=['GET'])
+@limiter.cost(0)
+def get_write_job(job_id):
+    job = write_queue.job(job_id)
+    if job is None:
+        return jsonify({"msg": f"The write {job_id} doesn't exist or has expired"}), 404
+    return jsonify(job), 200
 
 #TODOS LOS MÉTODOS DE USERS
 
 @app.route('/user', methods=['GET'])
+@limiter.cost(5)
 def get_users():
-    users = User.query.all()
-    users_serialized = list(map(lambda x: x.serialize(), users))
+    fields = select_fields(User)
+    ids = ids_arg()
+    if ids is not None:
+        users, missing = get_many(fields.apply(User.query), User, ids)
+        return jsonify({"msg": "Hello, this is your GET /user response", "users": list(map(fields.serialize, users)), "missing": missing}), 200
+    if wants_stream():
+        return stream_ndjson(fields.apply(User.query), User, fields.serialize)
+
+    users, next_url = keyset_page(fields.apply(User.query), User)
+    users_serialized = list(map(fields.serialize, users))
     response_body = {
         "msg": "Hello, this is your GET /user response",
-        "users" : users_serialized
+        "users" : users_serialized,
+        "next": next_url
     }
 
     return jsonify(response_body), 200
 
 @app.route('/user/<int:user_id>', methods=['GET'])
 def get_single_user(user_id):
-    single_user = User.query.get(user_id)
+    fields = select_fields(User)
+    single_user = fields.apply(User.query).get(user_id)
     if single_user is None:
         return jsonify({"msg": f"The id {user_id} user doesn't exist"}), 404
     
     response_body = {
         "msg": "Hello, this is your GET /user response ",
-        "user_info" : single_user.serialize()
+        "user_info" : fields.serialize(single_user)
     }
 
     return jsonify(response_body), 200
 
-@app.route('/user', methods=['POST'])
-def post_user():
-    body = request.get_json(silent=True)
-    if body is None:
-        raise APIException("You must send body information", status_code=400)
-    
-    if "username" not in body:
-        raise APIException("You must send an username", status_code=404)
-
-    if "email" not in body:
-        raise APIException("You must send an email", status_code=404)
-    
-    if "password" not in body:
-        raise APIException("You must send a password", status_code=404)
-    print(body)
-
-    new_user = User(username = body["username"], email = body["email"], password = body["password"], is_active = True)
+@write_queue.handler("create_user")
+def create_user(body):
+    new_user = User(**user_schema.values(body), is_active = True)
     db.session.add(new_user)
-    db.session.commit()
-
-    return jsonify({"msg" : "User has been added successfully"}), 201
+    return {"msg" : "User has been added successfully"}, 201
 
+@app.route('/user', methods=['POST'])
+@idempotent
+def post_user():
+    body = user_schema.validate(request.get_json(silent=True))
+    return write_queue.submit("create_user", body)
 
 @app.route('/user', methods=['PUT'])
 def modify_user():
-    body = request.get_json(silent=True)
-    if body is None:
-        raise APIException("You must send body information", status_code=400)
+    body = user_update_schema.validate(request.get_json(silent=True), require_id=True)
 
-    if "id" not in body:
-        raise APIException("you must send the user id to be modified", status_code=404)
-    
-    if "username" not in body:
-            raise APIException("You must send a new username or write the current one", status_code=404)
-    
-    if "email" not in body:
-        raise APIException("You must send a new email or write the current one", status_code=404)
-    
     single_users = User.query.get(body["id"])
-    single_users.username = body["username"]
-    single_users.email = body["email"]
+    if single_users is None:
+        raise APIException("This user doesn't exist", status_code=404)
+    check_if_match(single_users)
+    for field, value in user_update_schema.values(body).items():
+        setattr(single_users, field, value)
     db.session.commit()
-    return jsonify({"msg" : "User has been updated successfully"})
+    return jsonify({"msg" : "User has been updated successfully", "version": single_users.version})
 
 @app.route('/user/<int:user_id>', methods=['DELETE'])
 def delete_user(user_id):
     single_user = User.query.get(user_id)
     if single_user is None:
         raise APIException("This user doesn't exist", status_code=400)
+    check_if_match(single_user)
+    forget_user_favorites(user_id)
     db.session.delete(single_user)
     db.session.commit()
     return jsonify({"msg" : "User has been deleted successfully"})
 
+@app.route('/user/<int:user_id>/favorites', methods=['GET'])
+def get_user_favorites(user_id):
+    if User.query.get(user_id) is None:
+        return jsonify({"msg": f"The id {user_id} user doesn't exist"}), 404
+    query = UserFavorite.query.filter(UserFavorite.user_id == user_id)
+    item_type = request.args.get("type")
+    if item_type:
+        query = query.filter(UserFavorite.item_type == item_type)
+    favorites, next_url = keyset_page(query, UserFavorite)
+    response_body = {
+        "msg": "Hello, this is your GET /user favorites response",
+        "favorites": [favorite.serialize() for favorite in favorites],
+        "next": next_url
+    }
+    return jsonify(response_body), 200
+
+# is each of ?characters=1,2&planets=3 a favorite of this user, in one query
+@app.route('/user/<int:user_id>/favorites/check', methods=['GET'])
+def check_user_favorites(user_id):
+    return jsonify(favorite_membership(user_id, membership_args())), 200
+
+@write_queue.handler("add_user_favorites")
+def add_user_favorites(payload):
+    if User.query.get(payload["user_id"]) is None:
+        raise APIException("This user doesn't exist", status_code=404)
+    result = add_favorites(payload["user_id"], payload["items"])
+    status = 201 if result["added"] else 200 if result["already_favorite"] else 400
+    return {"msg": f"{result['added']} favorites have been added", **result}, status
+
+@write_queue.handler("remove_user_favorites")
+def remove_user_favorites(payload):
+    if User.query.get(payload["user_id"]) is None:
+        raise APIException("This user doesn't exist", status_code=404)
+    result = remove_favorites(payload["user_id"], payload["items"])
+    return {"msg": f"{result['removed']} favorites have been removed", **result}, 200
+
+def user_favorites_payload(user_id):
+    # checked before submit(): with write-behind on, whatever the handler
+    # rejects only shows up in the job status, after a 202
+    items = get_bulk_body()
+    if User.query.get(user_id) is None:
+        raise APIException("This user doesn't exist", status_code=404)
+    wanted, errors = parse_items(items)
+    if not wanted:
+        raise APIException("Invalid favorite information", status_code=400, payload={"errors": errors})
+    return {"user_id": user_id, "items": items}
+
+# body: [{"type": "character", "id": 1}, {"type": "planet", "id": 3}, ...]
+@app.route('/user/<int:user_id>/favorites', methods=['POST'])
+@limiter.cost(2)
+@idempotent
+def post_user_favorites(user_id):
+    return write_queue.submit("add_user_favorites", user_favorites_payload(user_id))
+
+@app.route('/user/<int:user_id>/favorites', methods=['DELETE'])
+@limiter.cost(2)
+def delete_user_favorites(user_id):
+    return write_queue.submit("remove_user_favorites", user_favorites_payload(user_id))
+
 
 
 #TODOS LOS MÉTODOS DE CHARACTERS
 
 @app.route('/characters', methods=['GET'])
+@limiter.cost(5)
+@cache.cached("characters")
 def get_characters():
-    characters = Characters.query.all()
-    characters_serialized = list(map(lambda x: x.serialize(), characters))
+    if cards_enabled() and "fields" not in request.args:
+        # served from the precomputed cards, no joins and no nested serialization
+        query = filter_query(CharacterCard.query, planet_id=CharacterCard.planet_id, starship_id=CharacterCard.starship_id, name_prefix=CharacterCard.character_name)
+        ids = ids_arg()
+        if ids is not None:
+            characters, missing = get_many(query, CharacterCard, ids)
+            return jsonify({"msg": "Hello, this is your GET /characters response", "characters": [card.card for card in characters], "missing": missing}), 200
+        if wants_stream():
+            return stream_ndjson(query, CharacterCard)
+        characters, next_url = keyset_page(query, CharacterCard)
+        response_body = {
+            "msg": "Hello, this is your GET /characters response",
+            "characters" : [card.card for card in characters],
+            "next": next_url
+        }
+        return jsonify(response_body), 200
+
+    fields = select_fields(Characters)
+    query = filter_query(fields.apply(Characters.query), planet_id=Characters.planet_id, starship_id=Characters.starship_id, name_prefix=Characters.character_name)
+    ids = ids_arg()
+    if ids is not None:
+        characters, missing = get_many(query, Characters, ids)
+        return jsonify({"msg": "Hello, this is your GET /characters response", "characters": list(map(fields.serialize, characters)), "missing": missing}), 200
+    if wants_stream():
+        return stream_ndjson(query, Characters, fields.serialize)
+
+    characters, next_url = keyset_page(query, Characters)
+    characters_serialized = list(map(fields.serialize, characters))
     response_body = {
         "msg": "Hello, this is your GET /characters response",
-        "characters" : characters_serialized
+        "characters" : characters_serialized,
+        "next": next_url
     }
 
     return jsonify(response_body), 200
 
 @app.route('/characters/<int:character_id>', methods=['GET'])
+@cache.cached("characters")
 def get_single_character(character_id):
-    single_character = Characters.query.get(character_id)
+    if cards_enabled() and "fields" not in request.args:
+        card = get_character_card(character_id)
+        if card is None:
+            return jsonify({"msg": f"The id {character_id} user doesn't exist"}), 404
+        related = [card.card[name] and card.card[name]["version"] for name in ("planet", "starship")]
+        return versioned({"msg": "Hello, this is your GET /single character response ", "character_info": card.card},
+                         card.card["version"], *related)
+
+    fields = select_fields(Characters)
+    single_character = fields.apply(Characters.query).get(character_id)
     if single_character is None:
         return jsonify({"msg": f"The id {character_id} user doesn't exist"}), 404
     
     response_body = {
         "msg": "Hello, this is your GET /single character response ",
-        "character_info" : single_character.serialize()
+        "character_info" : fields.serialize(single_character)
     }
 
-    return jsonify(response_body), 200
+    # the planet and starship versions are part of the ETag when they are in the body
+    related = [getattr(single_character, name) for name in ("planet", "starship") if fields.includes(name)]
+    return versioned(response_body, single_character.version, *[item and item.version for item in related])
 
 @app.route('/characters', methods=['POST'])
+@idempotent
+@cache.invalidates("characters")
 def post_character():
-    body = request.get_json(silent=True)
-    if body is None:
-        raise APIException("You must send body information", status_code=400)
-    
-    if "character_name" not in body:
-        raise APIException("You must send a character name", status_code=404)
-
-    if "hair_color" not in body:
-        raise APIException("You must send a hair color", status_code=404)
-    
-    if "height" not in body:
-        raise APIException("You must send a height value", status_code=404)
-    
-    if "mass" not in body:
-        raise APIException("You must send a mass value", status_code=404)
+    body = character_schema.validate(request.get_json(silent=True))
 
-    if "skin_color" not in body:
-        raise APIException("You must send a skin color", status_code=404)
-    print(body)
-
-    new_character = Characters(character_name = body["character_name"], hair_color = body["hair_color"], height = body["height"], mass = body["mass"], skin_color = body["skin_color"])
+    new_character = Characters(**character_schema.values(body))
     db.session.add(new_character)
     db.session.commit()
 
     return jsonify({"msg" : "Character has been added successfully"}), 201
 
-
 @app.route('/characters', methods=['PUT'])
+@cache.invalidates("characters")
 def modify_character():
-    body = request.get_json(silent=True)
-    if body is None:
-        raise APIException("You must send body information", status_code=400)
+    body = character_schema.validate(request.get_json(silent=True), require_id=True)
 
-    if "character_name" not in body:
-        raise APIException("You must send a new character name or write the current one", status_code=404)
-    
-    if "id" not in body:
-        raise APIException("You must send the character id to be modified", status_code=404)
-    
-    if "hair_color" not in body:
-        raise APIException("You must send a new hair color or write the current one", status_code=404)
-
-    if "height" not in body:
-        raise APIException("You must send an new height value or write the current one", status_code=404)
-
-    if "mass" not in body:
-        raise APIException("You must send a new mass value or write the current one", status_code=404)
-    
-    if "skin_color" not in body:
-        raise APIException("You must send a new skin color or write the current one", status_code=404)
-    
     single_character = Characters.query.get(body["id"])
-    single_character.character_name = body["character_name"]
-    single_character.hair_color = body["hair_color"]
-    single_character.height = body["height"]
-    single_character.mass = body["mass"]
-    single_character.skin_color = body["skin_color"]
+    if single_character is None:
+        raise APIException("This character doesn't exist", status_code=404)
+    check_if_match(single_character)
+    for field, value in character_schema.values(body).items():
+        setattr(single_character, field, value)
     db.session.commit()
 
-    return jsonify({"msg" : "Character has been updated successfully"})
-
+    return jsonify({"msg" : "Character has been updated successfully", "version": single_character.version})
 
 @app.route('/characters/<int:character_id>', methods=['DELETE'])
+@cache.invalidates("characters")
 def delete_character(character_id):
     single_character = Characters.query.get(character_id)
     if single_character is None:
         raise APIException("This character doesn't exist", status_code=404)
+    check_if_match(single_character)
     db.session.delete(single_character)
+    forget_favorites("character", [character_id])
     db.session.commit()
     return jsonify({"msg" : "Character has been deleted successfully"})
 
+@app.route('/characters/bulk', methods=['POST'])
+@limiter.cost(20)
+@idempotent
+@cache.invalidates("characters")
+def post_characters_bulk():
+    result = bulk_create(Characters, get_bulk_body(), character_schema, on_write=refresh_character_cards)
+    status = 201 if result["created"] else 400
+    return jsonify({"msg": f"{result['created']} characters have been added", **result}), status
+
+@app.route('/characters/bulk', methods=['PUT'])
+@limiter.cost(20)
+@cache.invalidates("characters")
+def modify_characters_bulk():
+    result = bulk_update(Characters, get_bulk_body(), character_schema, on_write=refresh_character_cards)
+    status = 200 if result["updated"] else 400
+    return jsonify({"msg": f"{result['updated']} characters have been updated", **result}), status
+
+def characters_deleted(ids):
+    refresh_character_cards(ids)
+    forget_favorites("character", ids)
+
+@app.route('/characters/bulk', methods=['DELETE'])
+@limiter.cost(20)
+@cache.invalidates("characters")
+def delete_characters_bulk():
+    result = bulk_delete(Characters, get_bulk_body(), on_write=characters_deleted)
+    status = 200 if result["deleted"] else 404
+    return jsonify({"msg": f"{result['deleted']} characters have been deleted", **result}), status
+
 #TODOS LOS MÉTODOS DE PLANETS
 
 @app.route('/planets', methods=['GET'])
+@limiter.cost(5)
+@cache.cached("planets")
 def get_planets():
-    planets = Planets.query.all()
-    planets_serialized = list(map(lambda x: x.serialize(), planets))
+    fields = select_fields(Planets)
+    query = filter_query(fields.apply(Planets.query), name_prefix=Planets.planet_name)
+    ids = ids_arg()
+    if ids is not None:
+        planets, missing = get_many(query, Planets, ids)
+        return jsonify({"msg": "Hello, this is your GET /planets response", "planets": list(map(fields.serialize, planets)), "missing": missing}), 200
+    if wants_stream():
+        return stream_ndjson(query, Planets, fields.serialize)
+
+    planets, next_url = keyset_page(query, Planets)
+    planets_serialized = list(map(fields.serialize, planets))
     response_body = {
         "msg": "Hello, this is your GET /planets response",
-        "planets" : planets_serialized
+        "planets" : planets_serialized,
+        "next": next_url
     }
 
     return jsonify(response_body), 200
 
 @app.route('/planets/<int:planet_id>', methods=['GET'])
+@cache.cached("planets")
 def get_single_planet(planet_id):
-    single_planet = Planets.query.get(planet_id)
+    fields = select_fields(Planets)
+    single_planet = fields.apply(Planets.query).get(planet_id)
     if single_planet is None:
         return jsonify({"msg": f"The id {planet_id} planet doesn't exist"}), 404
     
     response_body = {
         "msg": "Hello, this is your GET /single planet response ",
-        "planet_info" : single_planet.serialize()
+        "planet_info" : fields.serialize(single_planet)
     }
 
-    return jsonify(response_body), 200
+    return versioned(response_body, single_planet.version)
 
 @app.route('/planets', methods=['POST'])
+@idempotent
+@cache.invalidates("planets")
 def post_planets():
-    body = request.get_json(silent=True)
-    if body is None:
-        raise APIException("You must send body information", status_code=400)
-    
-    if "planet_name" not in body:
-        raise APIException("You must send a planet name", status_code=404)
-
-    if "gravity" not in body:
-        raise APIException("You must send a gravity value", status_code=404)
-    
-    if "diameter" not in body:
-        raise APIException("You must send a diameter value", status_code=404)
-    
-    if "rotation_period" not in body:
-        raise APIException("You must send a rotation period value", status_code=404)
+    body = planet_schema.validate(request.get_json(silent=True))
 
-    print(body)
-
-    new_planet = Planets(planet_name = body["planet_name"], gravity = body["gravity"], diameter = body["diameter"], rotation_period = body["rotation_period"])
+    new_planet = Planets(**planet_schema.values(body))
     db.session.add(new_planet)
     db.session.commit()
 
     return jsonify({"msg" : "Planet has been added successfully"}), 201
 
-
 @app.route('/planets', methods=['PUT'])
+@cache.invalidates("planets", "characters")
 def modify_planets():
-    body = request.get_json(silent=True)
-    if body is None:
-        raise APIException("You must send body information", status_code=400)
-    
-    if "id" not in body:
-        raise APIException("You must send the planet id to be modified", status_code=404)
-
-    if "planet_name" not in body:
-        raise APIException("You must send a new planet name or write the current one", status_code=404)
-    
-    if "gravity" not in body:
-        raise APIException("You must send a new gravity value or write the current one", status_code=404)
+    body = planet_schema.validate(request.get_json(silent=True), require_id=True)
 
-    if "diameter" not in body:
-        raise APIException("You must send a new diameter value or write the current one", status_code=404)
-
-    if "rotation_period" not in body:
-        raise APIException("You must send a new rotation period value or write the current one", status_code=404)
-    
-    
     single_planet = Planets.query.get(body["id"])
-    single_planet.planet_name = body["planet_name"]
-    single_planet.gravity = body["gravity"]
-    single_planet.diameter = body["diameter"]
-    single_planet.rotation_period = body["rotation_period"]
+    if single_planet is None:
+        raise APIException("This planet doesn't exist", status_code=404)
+    check_if_match(single_planet)
+    for field, value in planet_schema.values(body).items():
+        setattr(single_planet, field, value)
     db.session.commit()
 
-    return jsonify({"msg" : "Planet has been updated successfully"})
-
+    return jsonify({"msg" : "Planet has been updated successfully", "version": single_planet.version})
 
 @app.route('/planets/<int:planet_id>', methods=['DELETE'])
+@cache.invalidates("planets", "characters")
 def delete_planets(planet_id):
     single_planet = Planets.query.get(planet_id)
     if single_planet is None:
         raise APIException("This planet doesn't exist", status_code=400)
+    check_if_match(single_planet)
     db.session.delete(single_planet)
+    forget_favorites("planet", [planet_id])
     db.session.commit()
     return jsonify({"msg" : "Planet has been deleted successfully"})
 
 
+@app.route('/planets/bulk', methods=['POST'])
+@limiter.cost(20)
+@idempotent
+@cache.invalidates("planets", "characters")
+def post_planets_bulk():
+    result = bulk_create(Planets, get_bulk_body(), planet_schema)
+    status = 201 if result["created"] else 400
+    return jsonify({"msg": f"{result['created']} planets have been added", **result}), status
+
+@app.route('/planets/bulk', methods=['PUT'])
+@limiter.cost(20)
+@cache.invalidates("planets", "characters")
+def modify_planets_bulk():
+    result = bulk_update(Planets, get_bulk_body(), planet_schema, on_write=refresh_planet_cards)
+    status = 200 if result["updated"] else 400
+    return jsonify({"msg": f"{result['updated']} planets have been updated", **result}), status
+
+def planets_deleted(ids):
+    refresh_planet_cards(ids)
+    forget_favorites("planet", ids)
+
+@app.route('/planets/bulk', methods=['DELETE'])
+@limiter.cost(20)
+@cache.invalidates("planets", "characters")
+def delete_planets_bulk():
+    result = bulk_delete(Planets, get_bulk_body(), on_write=planets_deleted)
+    status = 200 if result["deleted"] else 404
+    return jsonify({"msg": f"{result['deleted']} planets have been deleted", **result}), status
+
+
 #TODOS LOS MÉTODOS DE STARSHIPS
 
 @app.route('/starships', methods=['GET'])
+@limiter.cost(5)
+@cache.cached("starships")
 def get_starships():
-    starships = Starships.query.all()
-    starships_serialized = list(map(lambda x: x.serialize(), starships))
+    fields = select_fields(Starships)
+    query = filter_query(fields.apply(Starships.query), starship_class=Starships.starship_class, name_prefix=Starships.starship_name)
+    ids = ids_arg()
+    if ids is not None:
+        starships, missing = get_many(query, Starships, ids)
+        return jsonify({"msg": "Hello, this is your GET /starships response", "starships": list(map(fields.serialize, starships)), "missing": missing}), 200
+    if wants_stream():
+        return stream_ndjson(query, Starships, fields.serialize)
+
+    starships, next_url = keyset_page(query, Starships)
+    starships_serialized = list(map(fields.serialize, starships))
     response_body = {
         "msg": "Hello, this is your GET /starships response",
-        "starships" : starships_serialized
+        "starships" : starships_serialized,
+        "next": next_url
     }
 
     return jsonify(response_body), 200
 
 @app.route('/starships/<int:starship_id>', methods=['GET'])
+@cache.cached("starships")
 def get_single_starship(starship_id):
-    single_starship = Starships.query.get(starship_id)
+    fields = select_fields(Starships)
+    single_starship = fields.apply(Starships.query).get(starship_id)
     if single_starship is None:
         return jsonify({"msg": f"The id {starship_id} starship doesn't exist"}), 404
     
     response_body = {
         "msg": "Hello, this is your GET /single starship response ",
-        "starship_info" : single_starship.serialize()
+        "starship_info" : fields.serialize(single_starship)
     }
 
-    return jsonify(response_body), 200
+    return versioned(response_body, single_starship.version)
 
 @app.route('/starships', methods=['POST'])
+@idempotent
+@cache.invalidates("starships")
 def post_starships():
-    body = request.get_json(silent=True)
-    if body is None:
-        raise APIException("You must send body information", status_code=400)
-    
-    if "starship_name" not in body:
-        raise APIException("You must send the starship name", status_code=404)
-
-    if "model" not in body:
-        raise APIException("You must send the starship model", status_code=404)
-    
-    if "starship_class" not in body:
-        raise APIException("You must send the starship class", status_code=404)
-    
-    if "length" not in body:
-        raise APIException("You must send the starship length value", status_code=404)
-    
-    if "crew" not in body:
-        raise APIException("You must send the starship crew value", status_code=404)
+    body = starship_schema.validate(request.get_json(silent=True))
 
-    print(body)
-
-    new_starship = Starships(starship_name = body["starship_name"], model = body["model"], starship_class = body["starship_class"], length = body["length"], crew = body["crew"])
+    new_starship = Starships(**starship_schema.values(body))
     db.session.add(new_starship)
     db.session.commit()
 
     return jsonify({"msg" : "Starship has been added successfully"}), 201
 
-
 @app.route('/starships', methods=['PUT'])
+@cache.invalidates("starships", "characters")
 def modify_starships():
-    body = request.get_json(silent=True)
-    if body is None:
-        raise APIException("You must send body information", status_code=404)
-    
-    if "id" not in body:
-        raise APIException("you must send the starship id to be modified", status_code=404)
-    
-    if "starship_name" not in body:
-        raise APIException("You must send the new starship name or write the current one", status_code=404)
-
-    if "model" not in body:
-        raise APIException("You must send the new starship model or write the current one", status_code=404)
-
-    if "starship_class" not in body:
-        raise APIException("You must send the new starship class or write the current one", status_code=404)
-
-    if "length" not in body:
-        raise APIException("You must send the new starship length value or write the current one", status_code=404)
-
-    if "crew" not in body:
-        raise APIException("You must send the new starship crew value or write the current one", status_code=404)
-
-    single_character = Starships.query.get(body["id"])
-    single_character.starship_name = body["starship_name"]
-    single_character.model = body["model"]
-    single_character.starship_class = body["starship_class"]
-    single_character.length = body["length"]
-    single_character.crew = body["crew"]
+    body = starship_schema.validate(request.get_json(silent=True), require_id=True)
 
+    single_starship = Starships.query.get(body["id"])
+    if single_starship is None:
+        raise APIException("This starship doesn't exist", status_code=404)
+    check_if_match(single_starship)
+    for field, value in starship_schema.values(body).items():
+        setattr(single_starship, field, value)
     db.session.commit()
 
-    return jsonify({"msg" : "Starship has been updated successfully"})
-
+    return jsonify({"msg" : "Starship has been updated successfully", "version": single_starship.version})
 
 @app.route('/starships/<int:starship_id>', methods=['DELETE'])
+@cache.invalidates("starships", "characters")
 def delete_starships(starship_id):
     single_starship = Starships.query.get(starship_id)
     if single_starship is None:
         raise APIException(f"This starship {starship_id} doesn't exist", status_code=404)
+    check_if_match(single_starship)
     db.session.delete(single_starship)
+    forget_favorites("starship", [starship_id])
     db.session.commit()
     return jsonify({"msg" : "Starship has been deleted successfully"})
 
 
+@app.route('/starships/bulk', methods=['POST'])
+@limiter.cost(20)
+@idempotent
+@cache.invalidates("starships", "characters")
+def post_starships_bulk():
+    result = bulk_create(Starships, get_bulk_body(), starship_schema)
+    status = 201 if result["created"] else 400
+    return jsonify({"msg": f"{result['created']} starships have been added", **result}), status
+
+@app.route('/starships/bulk', methods=['PUT'])
+@limiter.cost(20)
+@cache.invalidates("starships", "characters")
+def modify_starships_bulk():
+    result = bulk_update(Starships, get_bulk_body(), starship_schema, on_write=refresh_starship_cards)
+    status = 200 if result["updated"] else 400
+    return jsonify({"msg": f"{result['updated']} starships have been updated", **result}), status
+
+def starships_deleted(ids):
+    refresh_starship_cards(ids)
+    forget_favorites("starship", ids)
+
+@app.route('/starships/bulk', methods=['DELETE'])
+@limiter.cost(20)
+@cache.invalidates("starships", "characters")
+def delete_starships_bulk():
+    result = bulk_delete(Starships, get_bulk_body(), on_write=starships_deleted)
+    status = 200 if result["deleted"] else 404
+    return jsonify({"msg": f"{result['deleted']} starships have been deleted", **result}), status
 
 
 #TODOS LOS MÉTODOS DE FAVORITES
 
 @app.route('/favorites', methods=['GET'])
+@limiter.cost(5)
 def get_favorites():
-    favorites = Favorites.query.all()
-    favorites_serialized = list(map(lambda x: x.serialize(), favorites))
+    fields = select_fields(Favorites)
+    query = filter_query(fields.apply(Favorites.query), character_id=Favorites.character_id, planet_id=Favorites.planet_id, starship_id=Favorites.starship_id)
+    if wants_stream():
+        return stream_ndjson(query, Favorites, fields.serialize)
+
+    favorites, next_url = keyset_page(query, Favorites)
+    favorites_serialized = list(map(fields.serialize, favorites))
     response_body = {
         "msg": "Hello, this is your GET /favorite lists response",
-        "Favorite lists" : favorites_serialized
+        "Favorite lists" : favorites_serialized,
+        "next": next_url
     }
 
     return jsonify(response_body), 200
 
 @app.route('/favorites/<int:favorite_id>', methods=['GET'])
 def get_single_favorite(favorite_id):
-    single_favorite = Favorites.query.get(favorite_id)
+    fields = select_fields(Favorites)
+    single_favorite = fields.apply(Favorites.query).get(favorite_id)
     if single_favorite is None:
         return jsonify({"msg": f"The id {favorite_id} favorite list doesn't exist"}), 404
     
     response_body = {
         "msg": "Hello, this is your GET /favorite list response ",
-        "favorite_list_info" : single_favorite.serialize()
+        "favorite_list_info" : fields.serialize(single_favorite)
     }
 
     return jsonify(response_body), 200
 
 # ... (código anterior) ...
-@app.route('/favorites', methods=['POST'])
-def post_favorites():
-    body = request.get_json(silent=True)
-    if body is None:
-        raise APIException("You must send body information", status_code=400)
-    
-    if "list_name" not in body:
-        raise APIException("You must send a list name", status_code=400)
-    
-    if "character_id" not in body:
-        raise APIException("You must send a character ID", status_code=400)
-
-    if "planet_id" not in body:
-        raise APIException("You must send a planet ID", status_code=400)
-    
-    if "starship_id" not in body:
-        raise APIException("You must send a starship ID", status_code=400)
-
-    new_favorite_list = Favorites(
-        list_name=body["list_name"],
-        character_id=body["character_id"],
-        planet_id=body["planet_id"],
-        starship_id=body["starship_id"]
-    )
+@write_queue.handler("create_favorite_list")
+def create_favorite_list(body):
+    new_favorite_list = Favorites(**favorite_schema.values(body))
 
     db.session.add(new_favorite_list)
-    db.session.commit()
 
-    return jsonify({"msg": "Favorite list has been added successfully"}), 201
+    return {"msg": "Favorite list has been added successfully"}, 201
+
+@app.route('/favorites', methods=['POST'])
+@idempotent
+def post_favorites():
+    body = favorite_schema.validate(request.get_json(silent=True))
+    return write_queue.submit("create_favorite_list", body)
 
 @app.route('/favorites/<int:favorite_id>', methods=['PUT'])
 def update_favorite(favorite_id):
-    favorite = Favorites.query.get(favorite_id)
+    body = favorite_schema.validate(request.get_json(silent=True), partial=True)
 
+    favorite = Favorites.query.get(favorite_id)
     if favorite is None:
         return jsonify({"error": "Favorite not found"}), 404
-
-    data = request.get_json()
-
-    if 'list_name' in data:
-        favorite.list_name = data['list_name']
-
-    if 'planet' in data:
-        new_planet = Planets.query.get(data['planet'])
-        favorite.planets = new_planet
-
-
-    if 'character' in data:
-        new_character = Characters.query.get(data['character'])
-        favorite.characters = new_character
-
-    if 'starship' in data:
-        new_starship = Starships.query.get(data['starship'])
-        favorite.starships = new_starship
-
+    check_if_match(favorite)
+    for field, value in favorite_schema.values(body).items():
+        setattr(favorite, field, value)
     db.session.commit()
-    return jsonify({"msg": "Favorite updated successfully"}), 200
+
+    return jsonify({"msg": "Favorite updated successfully", "version": favorite.version}), 200
 
 
 
@@ -508,6 +801,7 @@ def delete_favorite(favorite_id):
 
     if favorite is None:
         return jsonify({"error": "Favorite not found"}), 404
+    check_if_match(favorite)
 
     db.session.delete(favorite)
     db.session.commit()
@@ -0,0 +1,168 @@
+"""
+Optional ASGI entry point. The plain GET reads of users and favorite lists
+(collections with ?limit=/?after= and single items) run on an async SQLAlchemy
+session, so one process keeps many slow queries in flight instead of pinning a
+sync worker per request. They are the reads the Flask app doesn't cache; the
+characters, planets and starships GETs stay in Flask, where the response cache,
+the ETags/304s and the character cards are. Every other request is handed to
+the Flask app unchanged through asgiref's WSGI adapter.
+
+Needs `uvicorn`, `asgiref` and an async driver (`asyncpg` or `aiosqlite`):
+
+    $ uvicorn asgi:application --app-dir src --workers 2
+"""
+import re
+import time
+from collections import namedtuple
+from urllib.parse import parse_qs, urlencode
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from app import app
+from engine import engine_options
+from models import User, Favorites
+
+ReadRoute = namedtuple("ReadRoute", "model list_key list_msg item_key item_msg missing_msg")
+
+# bodies match the Flask handlers in app.py
+READ_ROUTES = {
+    "user": ReadRoute(User, "users", "Hello, this is your GET /user response",
+                      "user_info", "Hello, this is your GET /user response ", "The id {} user doesn't exist"),
+    "favorites": ReadRoute(Favorites, "Favorite lists", "Hello, this is your GET /favorite lists response",
+                           "favorite_list_info", "Hello, this is your GET /favorite list response ",
+                           "The id {} favorite list doesn't exist"),
+}
+READ_PATH = re.compile(r"^/(user|favorites)(?:/(\d+))?/?$")
+# anything else (fields, filters, streaming, conditional requests...) goes to Flask
+ASYNC_PARAMS = {"limit", "after"}
+CONDITIONAL_HEADERS = {b"if-none-match", b"if-modified-since"}
+
+
+def async_database_uri(uri):
+    if uri.startswith("postgresql://"):
+        return uri.replace("postgresql://", "postgresql+asyncpg://", 1)
+    if uri.startswith("sqlite://"):
+        return uri.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    raise RuntimeError(f"No async driver configured for {uri.split(':')[0]}")
+
+def async_engine_options(uri):
+    options = engine_options(uri)
+    # the sync pool class and DBAPI arguments don't apply to the async drivers
+    options.pop("connect_args", None)
+    if options.pop("poolclass", None) is not None:
+        options["poolclass"] = AsyncAdaptedQueuePool
+    return options
+
+
+class AsyncReadApp:
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = WsgiToAsgi(flask_app)
+        uri = flask_app.config["SQLALCHEMY_DATABASE_URI"]
+        self.engine = create_async_engine(async_database_uri(uri), **async_engine_options(uri))
+        self.session = sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+        self.limiter = flask_app.extensions["rate_limiter"]
+        self.compressor = flask_app.extensions["compressor"]
+        self.metrics = flask_app.extensions["request_metrics"]
+        self.url_adapter = flask_app.url_map.bind("localhost")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] == "http" and scope["method"] == "GET":
+            match = READ_PATH.match(scope["path"])
+            headers = dict(scope["headers"])
+            args = parse_qs(scope["query_string"].decode())
+            if match and set(args) <= ASYNC_PARAMS and not CONDITIONAL_HEADERS & headers.keys() \
+                    and b"ndjson" not in headers.get(b"accept", b""):
+                # same buckets and route costs as the Flask before_request hook
+                endpoint = self.url_adapter.match(scope["path"], "GET")[0]
+                retry_after = self.limiter.admit(self.client_id(scope, headers), endpoint)
+                if retry_after is not None:
+                    return await self.send_json(send, 429, {"message": "Too many requests", "retry_after": retry_after},
+                                                [(b"retry-after", str(retry_after).encode())])
+                started = time.perf_counter()
+                response = await self.read(match.group(1), match.group(2), args)
+                if response is not None:
+                    accepted = parse_accept_header(headers.get(b"accept-encoding", b"").decode(), Accept)
+                    await self.send_json(send, *response, encoding=self.compressor.negotiate(accepted))
+                    # one statement per read, its time is most of the request's
+                    elapsed = time.perf_counter() - started
+                    self.metrics.record(endpoint, "GET", response[0], elapsed, 1, elapsed)
+                    return
+        return await self.wsgi(scope, receive, send)
+
+    def client_id(self, scope, headers):
+        forwarded = headers.get(b"x-forwarded-for")
+        if self.limiter.trust_proxy and forwarded:
+            return forwarded.decode().split(",")[0].strip()
+        return scope["client"][0] if scope.get("client") else None
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                # closes the pooled connections (and aiosqlite's worker threads)
+                await self.engine.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def read(self, name, item_id, args):
+        route = READ_ROUTES[name]
+        model = route.model
+        async with self.session() as session:
+            if item_id is not None:
+                item = await session.get(model, int(item_id))
+                if item is None:
+                    return 404, {"msg": route.missing_msg.format(item_id)}
+                return 200, {"msg": route.item_msg, route.item_key: item.serialize()}
+
+            try:
+                limit = int(args.get("limit", [self.flask_app.config["PAGE_SIZE"]])[0])
+                after = int(args["after"][0]) if "after" in args else None
+            except ValueError:
+                return None
+            if limit < 1 or limit > self.flask_app.config["MAX_PAGE_SIZE"]:
+                # let Flask build the usual 400 error
+                return None
+
+            query = select(model).order_by(model.id).limit(limit + 1)
+            if after is not None:
+                query = query.where(model.id > after)
+            items = (await session.execute(query)).scalars().all()
+
+        next_url = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_url = f"/{name}?" + urlencode({"limit": limit, "after": items[-1].id})
+        return 200, {"msg": route.list_msg, route.list_key: [item.serialize() for item in items], "next": next_url}
+
+    async def send_json(self, send, status, body, headers=(), encoding=None):
+        data = self.flask_app.json.dumps(body).encode()
+        headers = list(headers)
+        if self.compressor.enabled:
+            headers.append((b"vary", b"Accept-Encoding"))
+            # same size threshold as the Flask responses
+            if encoding and status == 200 and len(data) >= self.compressor.min_size:
+                data = self.compressor.compress_bytes(data, encoding)
+                headers.append((b"content-encoding", encoding.encode()))
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(data)).encode()),
+                (b"access-control-allow-origin", b"*"),
+                *headers,
+            ],
+        })
+        await send({"type": "http.response.body", "body": data})
+
+
+application = AsyncReadApp(app)
@@ -0,0 +1,136 @@
+from flask import request, current_app
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from models import db
+from utils import APIException
+
+
+def get_bulk_body():
+    body = request.get_json(silent=True)
+    if not isinstance(body, list):
+        raise APIException("You must send a list of objects", status_code=400)
+    if len(body) == 0:
+        raise APIException("The list is empty", status_code=400)
+    max_items = current_app.config.get("BULK_MAX_ITEMS", 10000)
+    if len(body) > max_items:
+        raise APIException(f"You can send at most {max_items} items per request", status_code=413)
+    return body
+
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def commit_or_conflict():
+    try:
+        db.session.commit()
+    except IntegrityError as error:
+        db.session.rollback()
+        raise APIException("The batch conflicts with existing data, nothing was written", status_code=409,
+                           payload={"detail": str(error.orig)})
+
+def bulk_create(model, items, schema, on_write=None):
+    # Every valid item is inserted in one transaction with executemany batches,
+    # invalid items are reported by index and skipped. on_write(ids) runs in the
+    # same transaction before the commit.
+    errors = []
+    rows = []
+    for index, item in enumerate(items):
+        problems = schema.errors(item)
+        if problems:
+            errors.append({"index": index, "errors": problems})
+        else:
+            rows.append(schema.values(item))
+
+    # executemany doesn't return the new ids: they are the ones above the
+    # current maximum (an index range scan), only looked up for on_write
+    if on_write is not None:
+        last_id = db.session.query(db.func.max(model.id)).scalar() or 0
+    batch_size = current_app.config.get("BULK_BATCH_SIZE", 1000)
+    for batch in chunks(rows, batch_size):
+        # render_nulls stops null values from splitting the batch into several statements
+        db.session.bulk_insert_mappings(model, batch, render_nulls=True)
+    if on_write is not None and rows:
+        on_write([row.id for row in db.session.query(model.id).filter(model.id > last_id)])
+    commit_or_conflict()
+    return {"created": len(rows), "errors": errors}
+
+def bulk_update(model, items, schema, on_write=None):
+    errors = []
+    candidates = []
+    for index, item in enumerate(items):
+        problems = schema.errors(item, require_id=True)
+        if problems:
+            errors.append({"index": index, "errors": problems})
+        else:
+            candidates.append((index, item))
+
+    # The models are versioned: every row is updated with "WHERE id = :id AND
+    # version = <version read here>", and an item may also send the version it
+    # expects. The ORM's own version check (bulk_update_mappings) would issue
+    # one UPDATE per row to check each rowcount, so the statement is built in
+    # Core and kept as one executemany per set of columns, checking the total.
+    ids = [item["id"] for _, item in candidates]
+    versions = {}
+    batch_size = current_app.config.get("BULK_BATCH_SIZE", 1000)
+    for batch in chunks(ids, batch_size):
+        versions.update(db.session.query(model.id, model.version).filter(model.id.in_(batch)))
+
+    # the same id twice in one request is merged into one row, the later
+    # item's values winning: updates of one row must not be split across the
+    # per-column-set statements below, which don't run in request order
+    rows_by_id = {}
+    updated = 0
+    for index, item in candidates:
+        if item["id"] not in versions:
+            errors.append({"index": index, "errors": [f"id {item['id']} doesn't exist"]})
+        elif "version" in item and item["version"] != versions[item["id"]]:
+            errors.append({"index": index, "errors": [f"id {item['id']} is at version {versions[item['id']]}"]})
+        else:
+            row = rows_by_id.setdefault(item["id"], {"b_id": item["id"], "b_version": versions[item["id"]]})
+            row.update(schema.values(item))
+            updated += 1
+    rows = list(rows_by_id.values())
+
+    table = model.__table__
+    matched = 0
+    for batch in chunks(rows, batch_size):
+        groups = {}
+        for row in batch:
+            groups.setdefault(tuple(key for key in row if not key.startswith("b_")), []).append(row)
+        for group in groups.values():
+            # the other keys of the parameters become the SET clause
+            statement = table.update() \
+                .where(table.c.id == bindparam("b_id"), table.c.version == bindparam("b_version")) \
+                .values(version=table.c.version + 1)
+            matched += db.session.execute(statement, group).rowcount
+    if rows and matched >= 0 and matched != len(rows):
+        # another request updated or deleted some of these rows in between
+        raise StaleDataError(f"{len(rows)} rows to update, {matched} matched their version")
+
+    if on_write is not None and rows:
+        on_write([row["b_id"] for row in rows])
+    commit_or_conflict()
+    return {"updated": updated, "errors": errors}
+
+def bulk_delete(model, ids, on_write=None):
+    errors = []
+    candidates = []
+    for index, value in enumerate(ids):
+        if isinstance(value, int) and not isinstance(value, bool):
+            candidates.append((index, value))
+        else:
+            errors.append({"index": index, "errors": ["id must be an integer"]})
+
+    existing = set()
+    batch_size = current_app.config.get("BULK_BATCH_SIZE", 1000)
+    for batch in chunks([value for _, value in candidates], batch_size):
+        existing.update(row.id for row in db.session.query(model.id).filter(model.id.in_(batch)))
+        model.query.filter(model.id.in_(batch)).delete(synchronize_session=False)
+    if on_write is not None and existing:
+        on_write(list(existing))
+    commit_or_conflict()
+
+    errors += [{"index": index, "errors": [f"id {value} doesn't exist"]}
+               for index, value in candidates if value not in existing]
+    return {"deleted": len(existing), "errors": errors}
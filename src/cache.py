@@ -0,0 +1,217 @@
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from email.utils import formatdate
+from flask import request, current_app
+from utils import wants_stream
+
+
+class CacheBackend:
+    # Anything that can get/set values with a TTL and atomically increment a
+    # counter can back the response cache (e.g. a Redis client wrapper shared by
+    # every worker). LRUCache below is the in-process implementation.
+    # shared: every worker sees the same versions, so a write in one worker
+    # invalidates the others' ETags right away
+    shared = True
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def set_persistent(self, key, value):
+        # a value that must never be evicted (Last-Modified times)
+        self.set(key, value)
+
+    def incr(self, key):
+        raise NotImplementedError
+
+
+class LRUCache(CacheBackend):
+    shared = False
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        # counters and timestamps are kept apart from the LRU entries so a
+        # table version can never be evicted and reset under memory pressure
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._counters:
+                return self._counters[key]
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def set_persistent(self, key, value):
+        with self._lock:
+            self._counters[key] = value
+
+    def incr(self, key):
+        with self._lock:
+            value = self._counters.get(key, 0) + 1
+            self._counters[key] = value
+            return value
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ResponseCache:
+    # Read-through cache for GET handlers. Every namespace (one per table) has a
+    # version counter that is part of the key; writes bump the counter so all
+    # older entries of that namespace stop matching and age out of the LRU.
+    # The same counter gives strong ETags, so conditional requests are answered
+    # with a 304 before any row is queried or serialized. A view can set its own
+    # ETag instead (the single-item GETs use the row version, which is what
+    # PUT/DELETE expect in If-Match); it is kept in the cache entry. With a
+    # per-process backend a worker doesn't see the writes served by the other
+    # workers, so its validators also change every CACHE_TTL seconds: a stale
+    # 304 lasts no longer than a stale cached body.
+    def __init__(self, backend=None, ttl=60, enabled=True):
+        self.backend = backend if backend is not None else LRUCache()
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        # versions restart at 0 with the process, the epoch keeps ETags handed
+        # out before a restart from matching new content
+        self.epoch = time.time()
+
+    def init_app(self, app):
+        self.ttl = app.config.get("CACHE_TTL", self.ttl)
+        self.enabled = app.config.get("CACHE_ENABLED", self.enabled)
+        app.extensions["response_cache"] = self
+
+    def version(self, namespace):
+        return self.backend.get(f"version:{namespace}") or 0
+
+    def window(self):
+        # start of the current CACHE_TTL window, 0 when versions are shared
+        if self.backend.shared or not self.ttl:
+            return 0
+        return int(time.time() // self.ttl * self.ttl)
+
+    def last_modified(self, namespace):
+        return max(self.backend.get(f"mtime:{namespace}") or self.epoch, self.window())
+
+    def invalidate(self, *namespaces):
+        for namespace in namespaces:
+            self.backend.incr(f"version:{namespace}")
+            # Last-Modified has one second resolution, round up so a write in
+            # the same second as the previous read still counts as newer
+            self.backend.set_persistent(f"mtime:{namespace}", math.ceil(time.time()))
+
+    def etag(self, namespace, version):
+        accept = request.headers.get("Accept", "")
+        # the gzip and identity bodies are different representations
+        encoding = request.headers.get("Accept-Encoding", "")
+        raw = f"{namespace}:{self.epoch}:{self.window()}:{version}:{request.full_path}:{accept}:{encoding}"
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def is_not_modified(self, etag, last_modified):
+        if request.if_none_match:
+            return request.if_none_match.contains(etag)
+        if request.if_modified_since:
+            return int(last_modified) <= request.if_modified_since.timestamp()
+        return False
+
+    def cached(self, *namespaces):
+        # a view reading several tables is keyed on the versions of all of them
+        namespace = "+".join(namespaces)
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if wants_stream():
+                    return view(*args, **kwargs)
+
+                version = ".".join(str(self.version(name)) for name in namespaces)
+                etag = self.etag(namespace, version)
+                last_modified = max(self.last_modified(name) for name in namespaces)
+                if self.is_not_modified(etag, last_modified):
+                    self.not_modified += 1
+                    response = current_app.response_class(status=304)
+                elif not self.enabled:
+                    response = current_app.make_response(view(*args, **kwargs))
+                else:
+                    response = self.read_through(f"resp:{namespace}:{version}:{request.full_path}", view, args, kwargs)
+
+                own_etag = response.get_etag()[0] if response.status_code == 200 else None
+                if own_etag is not None and request.if_none_match.contains(own_etag):
+                    self.not_modified += 1
+                    response = current_app.response_class(status=304)
+                if response.status_code in (200, 304):
+                    response.set_etag(own_etag or etag)
+                    response.headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+                return response
+            return wrapper
+        return decorator
+
+    def read_through(self, key, view, args, kwargs):
+        # entries are stored already compressed for the encoding the client
+        # accepts, so a hit is sent without encoding or compressing anything
+        compressor = current_app.extensions.get("compressor")
+        encoding = compressor.negotiate() if compressor else None
+        key = f"{key}:{encoding}"
+        entry = self.backend.get(key)
+        if entry is not None:
+            self.hits += 1
+            body, status, mimetype, content_encoding, etag = entry
+            response = current_app.response_class(body, status=status, mimetype=mimetype)
+            if content_encoding:
+                response.headers["Content-Encoding"] = content_encoding
+            if etag:
+                response.headers["ETag"] = etag
+            return response
+
+        self.misses += 1
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code == 200 and not response.is_streamed:
+            if encoding:
+                compressor.compress(response, encoding)
+            self.backend.set(key, (response.get_data(), response.status_code, response.mimetype,
+                                   response.headers.get("Content-Encoding"), response.headers.get("ETag")), self.ttl)
+        return response
+
+    def invalidates(self, *namespaces):
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                response = view(*args, **kwargs)
+                self.invalidate(*namespaces)
+                return response
+            return wrapper
+        return decorator
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "not_modified": self.not_modified,
+            "entries": len(self.backend) if hasattr(self.backend, "__len__") else None,
+        }
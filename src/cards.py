@@ -0,0 +1,98 @@
+from itertools import chain
+from flask import current_app
+from sqlalchemy import event
+from models import db, Characters, Planets, Starships, CharacterCard
+
+CHUNK_SIZE = 1000
+
+
+def card_row(character):
+    return {
+        "id": character.id,
+        "character_name": character.character_name,
+        "planet_id": character.planet_id,
+        "starship_id": character.starship_id,
+        "card": character.serialize(),
+    }
+
+def cards_enabled():
+    return current_app.config.get("CHARACTER_CARDS", True)
+
+def chunks(ids):
+    ids = list(dict.fromkeys(ids))
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+def refresh_character_cards(character_ids):
+    # Re-renders the cards of these characters inside the current transaction:
+    # one delete and one executemany insert per chunk, whatever the number of
+    # characters. Characters that no longer exist just lose their card.
+    db.session.flush()
+    for batch in chunks(character_ids):
+        CharacterCard.query.filter(CharacterCard.id.in_(batch)).delete(synchronize_session=False)
+        characters = Characters.query.filter(Characters.id.in_(batch)).all()
+        if characters:
+            # render_nulls keeps rows with and without a starship in the same executemany
+            db.session.bulk_insert_mappings(CharacterCard, [card_row(character) for character in characters],
+                                            render_nulls=True)
+
+def refresh_cards_by(column, ids):
+    # cards that embed one of these planets / starships
+    db.session.flush()
+    character_ids = []
+    for batch in chunks(ids):
+        character_ids += [row.id for row in db.session.query(Characters.id).filter(column.in_(batch))]
+        # characters pointing at a deleted planet/starship still carry its id on the card
+        card_column = getattr(CharacterCard, column.key)
+        character_ids += [row.id for row in db.session.query(CharacterCard.id).filter(card_column.in_(batch))]
+    refresh_character_cards(character_ids)
+
+def refresh_planet_cards(planet_ids):
+    refresh_cards_by(Characters.planet_id, planet_ids)
+
+def refresh_starship_cards(starship_ids):
+    refresh_cards_by(Characters.starship_id, starship_ids)
+
+def build_missing_cards():
+    # cards for characters that don't have one yet (bulk inserts, backfill)
+    db.session.flush()
+    missing = db.session.query(Characters.id).outerjoin(CharacterCard, CharacterCard.id == Characters.id) \
+        .filter(CharacterCard.id.is_(None))
+    refresh_character_cards([row.id for row in missing])
+
+def track_card_changes(session, flush_context):
+    # after_flush: characters/planets/starships written through the ORM in this
+    # transaction (handlers, admin), whatever code did it
+    pending = session.info.setdefault("card_changes", {})
+    for instance in chain(session.new, session.dirty, session.deleted):
+        if type(instance) in (Characters, Planets, Starships):
+            pending.setdefault(type(instance), set()).add(instance.id)
+
+def refresh_changed_cards(session):
+    # before_commit: re-render their cards in the same transaction. Core
+    # statements (the bulk endpoints) don't go through the flush and refresh
+    # the cards themselves. commit() only flushes after this hook, so flush first.
+    session.flush()
+    while session.info.get("card_changes"):
+        pending = session.info.pop("card_changes")
+        refresh_character_cards(pending.get(Characters, ()))
+        refresh_planet_cards(pending.get(Planets, ()))
+        refresh_starship_cards(pending.get(Starships, ()))
+
+def forget_card_changes(session, previous_transaction):
+    session.info.pop("card_changes", None)
+
+def setup_card_events(db):
+    # on the session class of db, so the admin app's sessions are covered too
+    event.listen(db.session, "after_flush", track_card_changes)
+    event.listen(db.session, "before_commit", refresh_changed_cards)
+    event.listen(db.session, "after_soft_rollback", forget_card_changes)
+
+def get_character_card(character_id):
+    card = CharacterCard.query.get(character_id)
+    if card is None and Characters.query.get(character_id) is not None:
+        # written behind the API's back (admin, SQL), repair on read
+        refresh_character_cards([character_id])
+        db.session.commit()
+        card = CharacterCard.query.get(character_id)
+    return card
@@ -0,0 +1,79 @@
+import gzip
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional, responses are gzip-only without it
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "application/x-ndjson", "text/html", "text/plain"}
+
+
+class Compressor:
+    # gzip / brotli for response bodies of at least COMPRESS_MIN_SIZE bytes,
+    # negotiated from Accept-Encoding (brotli preferred when installed). The
+    # response cache calls compress() before storing an entry, so a cached
+    # body is compressed once and served as is on every hit; this after_request
+    # hook handles everything that isn't cached.
+    def __init__(self):
+        self.enabled = True
+        self.min_size = 1024
+        self.gzip_level = 6
+        self.brotli_quality = 4
+
+    def init_app(self, app):
+        self.enabled = app.config.get("COMPRESS_ENABLED", self.enabled)
+        self.min_size = app.config.get("COMPRESS_MIN_SIZE", self.min_size)
+        self.gzip_level = app.config.get("COMPRESS_LEVEL", self.gzip_level)
+        self.brotli_quality = app.config.get("COMPRESS_BR_QUALITY", self.brotli_quality)
+        app.extensions["compressor"] = self
+        app.after_request(self.after_request)
+
+    def negotiate(self, accepted=None):
+        # -> "br", "gzip" or None for the current request (or for a parsed
+        # Accept-Encoding header)
+        if not self.enabled:
+            return None
+        if accepted is None:
+            accepted = request.accept_encodings
+        if brotli is not None and accepted["br"]:
+            return "br"
+        if accepted["gzip"]:
+            return "gzip"
+        return None
+
+    def compressible(self, response):
+        return (response.status_code == 200
+                and not response.direct_passthrough
+                and not response.is_streamed
+                and "Content-Encoding" not in response.headers
+                and response.mimetype in COMPRESSIBLE_MIMETYPES
+                and response.content_length is not None
+                and response.content_length >= self.min_size)
+
+    def compress_bytes(self, data, encoding):
+        if encoding == "br":
+            return brotli.compress(data, quality=self.brotli_quality)
+        return gzip.compress(data, compresslevel=self.gzip_level, mtime=0)
+
+    def compress(self, response, encoding=None):
+        encoding = encoding or self.negotiate()
+        if encoding is None or not self.compressible(response):
+            return response
+        response.set_data(self.compress_bytes(response.get_data(), encoding))
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag is not None:
+            # the compressed body is a different representation: "<etag>-gzip"
+            response.set_etag(f"{etag}-{encoding}", weak)
+        return response
+
+    def after_request(self, response):
+        if self.enabled:
+            response.vary.add("Accept-Encoding")
+            etag = response.get_etag()[0]
+            self.compress(response)
+            if etag is not None and response.get_etag()[0] != etag:
+                # the view compared If-None-Match with the ETag before the encoding was added
+                response.make_conditional(request)
+        return response
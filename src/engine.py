@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+
+def env_int(name, default=None):
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+def env_flag(name, default):
+    value = os.getenv(name)
+    if value in (None, ""):
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+class PoolStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.connects = 0
+        self.invalidated = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_wait(self, seconds):
+        with self.lock:
+            self.checkouts += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    # Times how long each checkout waits for a free connection, which is what
+    # grows first when pool_size + max_overflow is too small for the workers.
+    def _do_get(self):
+        started = time.perf_counter()
+        connection = super()._do_get()
+        pool_stats.record_wait(time.perf_counter() - started)
+        return connection
+
+
+def engine_options(database_uri):
+    # SQLALCHEMY_ENGINE_OPTIONS from DB_* / SQLITE_* environment variables
+    options = {"pool_pre_ping": env_flag("DB_POOL_PRE_PING", True)}
+    if database_uri.rstrip("/") == "sqlite:" or ":memory:" in database_uri:
+        # in-memory SQLite lives in a single connection, keep SQLAlchemy's pool for it
+        return options
+
+    options.update(
+        poolclass=InstrumentedQueuePool,
+        pool_size=env_int("DB_POOL_SIZE", 5),
+        max_overflow=env_int("DB_MAX_OVERFLOW", 10),
+        pool_timeout=env_int("DB_POOL_TIMEOUT", 30),
+        pool_recycle=env_int("DB_POOL_RECYCLE", 1800),
+    )
+    if database_uri.startswith("sqlite"):
+        # pooled connections move between worker threads, and pysqlite waits
+        # this long on a locked database before raising
+        options["connect_args"] = {
+            "check_same_thread": False,
+            "timeout": env_int("SQLITE_BUSY_TIMEOUT_MS", 5000) / 1000,
+        }
+        return options
+
+    statement_timeout = env_int("DB_STATEMENT_TIMEOUT_MS")
+    if statement_timeout is not None and database_uri.startswith("postgresql"):
+        options["connect_args"] = {"options": f"-c statement_timeout={statement_timeout}"}
+    return options
+
+
+def setup_engine(app, db):
+    with app.app_context():
+        engine = db.engine
+
+    if engine.dialect.name == "sqlite":
+        journal_mode = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+        synchronous = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            # WAL lets readers run while a writer commits, NORMAL only syncs at checkpoints
+            if engine.url.database not in (None, "", ":memory:"):
+                cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+            cursor.execute(f"PRAGMA synchronous={synchronous}")
+            cursor.close()
+
+    @event.listens_for(engine, "connect")
+    def count_connect(dbapi_connection, connection_record):
+        pool_stats.connects += 1
+
+    @event.listens_for(engine, "invalidate")
+    def count_invalidate(dbapi_connection, connection_record, exception):
+        pool_stats.invalidated += 1
+
+    return engine
+
+
+def pool_status(engine):
+    pool = engine.pool
+    status = {
+        "pool": type(pool).__name__,
+        "connects": pool_stats.connects,
+        "invalidated": pool_stats.invalidated,
+        "checkouts": pool_stats.checkouts,
+        "wait_seconds_total": round(pool_stats.wait_seconds_total, 6),
+        "wait_seconds_max": round(pool_stats.wait_seconds_max, 6),
+    }
+    if isinstance(pool, QueuePool):
+        status.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow(),
+                      checked_in=pool.checkedin())
+    return status
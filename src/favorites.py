@@ -0,0 +1,114 @@
+from flask import request, current_app
+from sqlalchemy import or_, and_
+from models import db, UserFavorite, Characters, Planets, Starships
+from schemas import user_favorite_schema
+from bulk import chunks
+from utils import APIException
+
+FAVORITE_TYPES = {"character": Characters, "planet": Planets, "starship": Starships}
+
+
+def parse_items(items):
+    # -> ({type: [(index, id), ...]}, errors by index)
+    wanted = {}
+    errors = []
+    for index, item in enumerate(items):
+        problems = user_favorite_schema.errors(item)
+        if not problems and item["type"] not in FAVORITE_TYPES:
+            problems = [f"type must be one of {', '.join(FAVORITE_TYPES)}"]
+        if problems:
+            errors.append({"index": index, "errors": problems})
+        else:
+            wanted.setdefault(item["type"], []).append((index, item["id"]))
+    return wanted, errors
+
+def existing_ids(model, ids):
+    found = set()
+    for batch in chunks(list(set(ids)), current_app.config.get("BULK_BATCH_SIZE", 1000)):
+        found.update(row.id for row in db.session.query(model.id).filter(model.id.in_(batch)))
+    return found
+
+def favorited_ids(user_id, item_type, ids):
+    found = set()
+    for batch in chunks(list(set(ids)), current_app.config.get("BULK_BATCH_SIZE", 1000)):
+        found.update(row.item_id for row in db.session.query(UserFavorite.item_id).filter(
+            UserFavorite.user_id == user_id, UserFavorite.item_type == item_type, UserFavorite.item_id.in_(batch)))
+    return found
+
+def add_favorites(user_id, items):
+    # Two IN queries per type (does the item exist, is it already a favorite)
+    # and one executemany insert, however many items are sent. Adding an
+    # existing favorite is not an error. The caller commits.
+    wanted, errors = parse_items(items)
+    rows = []
+    already = 0
+    for item_type, entries in wanted.items():
+        ids = [item_id for _, item_id in entries]
+        found = existing_ids(FAVORITE_TYPES[item_type], ids)
+        current = favorited_ids(user_id, item_type, ids)
+        for index, item_id in entries:
+            if item_id not in found:
+                errors.append({"index": index, "errors": [f"{item_type} {item_id} doesn't exist"]})
+            elif item_id in current:
+                already += 1
+            else:
+                current.add(item_id)
+                rows.append({"user_id": user_id, "item_type": item_type, "item_id": item_id})
+
+    for batch in chunks(rows, current_app.config.get("BULK_BATCH_SIZE", 1000)):
+        db.session.bulk_insert_mappings(UserFavorite, batch)
+    return {"added": len(rows), "already_favorite": already, "errors": sorted(errors, key=lambda e: e["index"])}
+
+def remove_favorites(user_id, items):
+    # one DELETE ... IN per type; removing something that isn't a favorite is a no-op
+    wanted, errors = parse_items(items)
+    removed = 0
+    for item_type, entries in wanted.items():
+        ids = list({item_id for _, item_id in entries})
+        for batch in chunks(ids, current_app.config.get("BULK_BATCH_SIZE", 1000)):
+            removed += UserFavorite.query.filter(
+                UserFavorite.user_id == user_id, UserFavorite.item_type == item_type,
+                UserFavorite.item_id.in_(batch)).delete(synchronize_session=False)
+    return {"removed": removed, "errors": errors}
+
+def membership_args():
+    # ?characters=1,2,3&planets=4 -> {"character": [1, 2, 3], "planet": [4]}
+    wanted = {}
+    total = 0
+    for item_type in FAVORITE_TYPES:
+        param = f"{item_type}s"
+        value = request.args.get(param)
+        if not value:
+            continue
+        try:
+            ids = [int(part) for part in value.split(",") if part.strip()]
+        except ValueError:
+            raise APIException(f"{param} must be a comma separated list of ids", status_code=400)
+        wanted[item_type] = list(dict.fromkeys(ids))
+        total += len(wanted[item_type])
+    if not wanted:
+        raise APIException(f"Send at least one of {', '.join(t + 's' for t in FAVORITE_TYPES)}", status_code=400)
+    max_ids = current_app.config.get("MAX_PAGE_SIZE", 1000)
+    if total > max_ids:
+        raise APIException(f"You can check at most {max_ids} ids per request", status_code=400)
+    return wanted
+
+def favorite_membership(user_id, wanted):
+    # A single query on the unique (user_id, item_type, item_id) index for every type at once
+    conditions = [and_(UserFavorite.item_type == item_type, UserFavorite.item_id.in_(ids))
+                  for item_type, ids in wanted.items()]
+    rows = db.session.query(UserFavorite.item_type, UserFavorite.item_id) \
+        .filter(UserFavorite.user_id == user_id, or_(*conditions))
+    found = {(row.item_type, row.item_id) for row in rows}
+    return {f"{item_type}s": {str(item_id): (item_type, item_id) in found for item_id in ids}
+            for item_type, ids in wanted.items()}
+
+def forget_favorites(item_type, ids):
+    # deleted characters/planets/starships stop being anyone's favorite, in the
+    # same transaction as the delete
+    for batch in chunks(list(ids), current_app.config.get("BULK_BATCH_SIZE", 1000)):
+        UserFavorite.query.filter(UserFavorite.item_type == item_type, UserFavorite.item_id.in_(batch)) \
+            .delete(synchronize_session=False)
+
+def forget_user_favorites(user_id):
+    UserFavorite.query.filter(UserFavorite.user_id == user_id).delete(synchronize_session=False)
@@ -0,0 +1,132 @@
+from flask import request
+from sqlalchemy import inspect, orm
+from models import RELATIONSHIP_LOADING
+from utils import APIException, wants_stream
+
+LOADERS = {"selectin": "selectinload", "joined": "joinedload", "subquery": "subqueryload"}
+
+# names each model exposes through serialize(), worked out once per model
+_serialized_names = {}
+
+def serialized_names(model):
+    if model not in _serialized_names:
+        _serialized_names[model] = frozenset(model().serialize().keys())
+    return _serialized_names[model]
+
+def path_option(path, method, *args):
+    # loader option for the relationship path, e.g. path_option([Favorites.character], "load_only", ...)
+    # is defaultload(Favorites.character).load_only(...)
+    if not path:
+        return getattr(orm, method)(*args)
+    option = orm.defaultload(path[0])
+    for attribute in path[1:]:
+        option = option.defaultload(attribute)
+    return getattr(option, method)(*args)
+
+def relationship_loader():
+    # streamed responses use yield_per, which can't be combined with subqueryload
+    if RELATIONSHIP_LOADING == "subquery" and wants_stream():
+        return LOADERS["selectin"]
+    return LOADERS[RELATIONSHIP_LOADING]
+
+def parse_fields(spec):
+    # "id,planet.planet_name" -> {"id": {}, "planet": {"planet_name": {}}}
+    tree = {}
+    for path in spec.split(","):
+        path = path.strip()
+        if not path:
+            continue
+        node = tree
+        for name in path.split("."):
+            node = node.setdefault(name, {})
+    return tree
+
+
+class FieldSelection:
+    # Sparse fieldset from ?fields=. apply() restricts the SELECT to the
+    # requested columns and only loads the requested relationships, serialize()
+    # builds the trimmed dict without touching anything that wasn't loaded.
+    def __init__(self, model, tree):
+        self.model = model
+        self.tree = tree
+        self.validate(model, tree, "")
+
+    @staticmethod
+    def validate(model, tree, prefix):
+        mapper = inspect(model)
+        allowed = serialized_names(model)
+        for name, children in tree.items():
+            if name not in allowed:
+                raise APIException(f"Unknown field {prefix}{name}", status_code=400)
+            if name in mapper.relationships:
+                FieldSelection.validate(mapper.relationships[name].mapper.class_, children, f"{prefix}{name}.")
+            elif children:
+                raise APIException(f"{prefix}{name} has no nested fields", status_code=400)
+
+    def apply(self, query):
+        return query.options(*self.options(self.model, self.tree, []))
+
+    def includes(self, name):
+        return name in self.tree
+
+    def options(self, model, tree, path):
+        mapper = inspect(model)
+        columns = [mapper.primary_key[0].key]
+        if mapper.version_id_col is not None:
+            # the version goes into the ETag of single-item GETs
+            columns.append(mapper.get_property_by_column(mapper.version_id_col).key)
+        options = []
+        for name, children in tree.items():
+            if name in mapper.relationships:
+                relationship = mapper.relationships[name]
+                columns.extend(mapper.get_property_by_column(column).key for column in relationship.local_columns)
+                attribute = getattr(model, name)
+                options.append(path_option(path, relationship_loader(), attribute))
+                nested = relationship.mapper.class_
+                # a bare "planet" selects the whole nested object
+                children = children or dict.fromkeys(serialized_names(nested), {})
+                options.extend(self.options(nested, children, path + [attribute]))
+            else:
+                columns.append(name)
+
+        for name in mapper.relationships.keys():
+            if name not in tree:
+                options.append(path_option(path, "lazyload", getattr(model, name)))
+
+        options.append(path_option(path, "load_only", *[getattr(model, key) for key in dict.fromkeys(columns)]))
+        return options
+
+    def serialize(self, item, tree=None):
+        tree = self.tree if tree is None else tree
+        mapper = inspect(type(item))
+        result = {}
+        for name, children in tree.items():
+            value = getattr(item, name)
+            if name in mapper.relationships:
+                if value is None:
+                    result[name] = None
+                elif children:
+                    result[name] = self.serialize(value, children)
+                else:
+                    result[name] = value.serialize()
+            else:
+                result[name] = value
+        return result
+
+
+class AllFields:
+    def apply(self, query):
+        return query
+
+    def includes(self, name):
+        return True
+
+    def serialize(self, item):
+        return item.serialize()
+
+
+def select_fields(model):
+    spec = request.args.get("fields")
+    if not spec:
+        return AllFields()
+    return FieldSelection(model, parse_fields(spec))
@@ -0,0 +1,72 @@
+import threading
+import time
+from sqlalchemy import text
+from engine import pool_status
+
+
+class ReadinessProbe:
+    # /readyz: a SELECT 1 on a pooled connection, run by at most one thread at
+    # a time and cached for READY_CACHE_SECONDS, so a burst of probes from
+    # several load balancers costs one query. A probe waits READY_TIMEOUT_MS
+    # for the check and answers "not ready" past that instead of piling up
+    # behind a hung database; the check keeps running and updates the cache.
+    def __init__(self, db):
+        self.db = db
+        self.app = None
+        self.ttl = 1.0
+        self.timeout = 0.5
+        self.max_saturation = 1.0
+        self.lock = threading.Lock()
+        self.result = None
+        self.checked_at = 0.0
+        self.running = None
+
+    def init_app(self, app):
+        self.app = app
+        self.ttl = app.config.get("READY_CACHE_SECONDS", self.ttl)
+        self.timeout = app.config.get("READY_TIMEOUT_MS", self.timeout * 1000) / 1000
+        self.max_saturation = app.config.get("READY_MAX_POOL_SATURATION", self.max_saturation)
+
+    def pool(self):
+        # share of the pool's connections (size + max_overflow) in use
+        status = pool_status(self.db.engine)
+        options = self.app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+        capacity = options.get("pool_size", 0) + options.get("max_overflow", 0)
+        if "checked_out" in status and capacity > 0:
+            status["capacity"] = capacity
+            status["saturation"] = round(status["checked_out"] / capacity, 3)
+        return status
+
+    def run_check(self):
+        started = time.perf_counter()
+        try:
+            with self.app.app_context():
+                pool = self.pool()
+                if pool.get("saturation", 0) >= self.max_saturation:
+                    # a probe must not wait in line for a connection behind real traffic
+                    result = {"ready": False, "reason": "connection pool saturated", "pool": pool}
+                else:
+                    with self.db.engine.connect() as connection:
+                        connection.execute(text("SELECT 1"))
+                    result = {"ready": True, "pool": pool}
+        except Exception as error:
+            result = {"ready": False, "reason": f"database check failed: {type(error).__name__}"}
+        result["check_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        with self.lock:
+            self.result = result
+            self.checked_at = time.monotonic()
+            self.running = None
+
+    def check(self):
+        with self.lock:
+            if self.result is not None and time.monotonic() - self.checked_at < self.ttl:
+                return dict(self.result, cached=True)
+            if self.running is None:
+                self.running = threading.Thread(target=self.run_check, daemon=True)
+                self.running.start()
+            running = self.running
+        running.join(self.timeout)
+        with self.lock:
+            if running.is_alive():
+                return {"ready": False, "reason": f"database check took more than {int(self.timeout * 1000)} ms"}
+            return dict(self.result, cached=False)
@@ -0,0 +1,88 @@
+import hashlib
+import time
+from functools import wraps
+from flask import request, current_app
+from sqlalchemy.exc import IntegrityError
+from models import db, IdempotencyKey
+from utils import APIException
+
+MAX_KEY_LENGTH = 255
+
+
+def idempotent(view):
+    # POST handlers: the first request with a given Idempotency-Key reserves
+    # the key, runs and stores its 2xx response; retries with the same key and
+    # body get that response back (Idempotent-Replayed: true) without touching
+    # the data. Failed requests release the key so they can be retried; a
+    # reservation whose request never finished (the process died between its
+    # commit and storing the response) can be taken over by a retry after
+    # IDEMPOTENCY_LEASE seconds.
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            raise APIException(f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters long", status_code=400)
+
+        scope = f"{request.method} {request.path}"
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        record, reserved = reserve(key, scope, fingerprint)
+        if record.fingerprint != fingerprint:
+            raise APIException("This Idempotency-Key was already used with a different body", status_code=422)
+        if record.status is not None:
+            response = current_app.response_class(record.body, status=record.status, mimetype=record.mimetype)
+            response.headers["Idempotent-Replayed"] = "true"
+            return response
+        if not reserved:
+            raise APIException("A request with this Idempotency-Key is still in progress", status_code=409)
+
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except Exception:
+            release(record.id)
+            raise
+        if 200 <= response.status_code < 300 and not response.is_streamed:
+            IdempotencyKey.query.filter(IdempotencyKey.id == record.id).update(
+                {"status": response.status_code, "body": response.get_data(), "mimetype": response.mimetype},
+                synchronize_session=False)
+            db.session.commit()
+        else:
+            release(record.id)
+        return response
+    return wrapper
+
+def reserve(key, scope, fingerprint):
+    # -> (record, True if this request created it)
+    now = time.time()
+    ttl = current_app.config.get("IDEMPOTENCY_TTL", 86400)
+    # expired keys are dropped on the way (created_at is indexed)
+    IdempotencyKey.query.filter(IdempotencyKey.created_at < now - ttl).delete(synchronize_session=False)
+    record = IdempotencyKey(key=key, scope=scope, fingerprint=fingerprint, created_at=now)
+    db.session.add(record)
+    try:
+        db.session.commit()
+        return record, True
+    except IntegrityError:
+        # the unique (key, scope) constraint makes concurrent retries race safely
+        db.session.rollback()
+    existing = IdempotencyKey.query.filter_by(key=key, scope=scope).first()
+    if existing is None:
+        # released by the other request in the meantime
+        return reserve(key, scope, fingerprint)
+    lease = current_app.config.get("IDEMPOTENCY_LEASE", 60)
+    if existing.status is None and existing.fingerprint == fingerprint and existing.created_at < now - lease:
+        # compare-and-set on created_at, so only one of several retries gets it
+        taken = IdempotencyKey.query.filter(
+            IdempotencyKey.id == existing.id, IdempotencyKey.status.is_(None),
+            IdempotencyKey.created_at == existing.created_at,
+        ).update({"created_at": now}, synchronize_session=False)
+        db.session.commit()
+        if taken:
+            return existing, True
+    return existing, False
+
+def release(record_id):
+    db.session.rollback()
+    IdempotencyKey.query.filter(IdempotencyKey.id == record_id).delete(synchronize_session=False)
+    db.session.commit()
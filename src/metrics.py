@@ -0,0 +1,122 @@
+import cProfile
+import os
+import threading
+import time
+from flask import request, g
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.count}'
+        yield f"{name}_sum{{{labels}}} {self.sum:.6f}"
+        yield f"{name}_count{{{labels}}} {self.count}"
+
+
+class RequestMetrics:
+    # Per-endpoint latency, SQL statement count and DB time, collected in
+    # before/after_request hooks (the statement count and DB time come from the
+    # engine hooks in utils.setup_query_counter) and rendered in the Prometheus
+    # text format. With PROFILE_SLOW_REQUESTS_MS set every request runs under
+    # cProfile and the ones slower than the threshold are dumped to PROFILE_DIR.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.latency = {}
+        self.statements = {}
+        self.db_time = {}
+        self.profile_threshold = None
+        self.profile_dir = None
+        self.extra_collectors = []
+
+    def init_app(self, app):
+        threshold = app.config.get("PROFILE_SLOW_REQUESTS_MS")
+        self.profile_threshold = float(threshold) / 1000 if threshold else None
+        self.profile_dir = app.config.get("PROFILE_DIR", "/tmp/profiles")
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        app.extensions["request_metrics"] = self
+
+    def add_collector(self, collector):
+        # collector() returns extra [(name, type, help, [(labels, value)])] to expose
+        self.extra_collectors.append(collector)
+
+    def start_request(self):
+        g.request_started = time.perf_counter()
+        if self.profile_threshold is not None:
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    def finish_request(self, response):
+        started = g.pop("request_started", None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or "unmatched"
+        self.record(endpoint, request.method, response.status_code, elapsed,
+                    g.get("query_count", 0), g.get("query_time", 0.0))
+
+        profiler = g.pop("profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            if elapsed >= self.profile_threshold:
+                self.dump_profile(profiler, endpoint, elapsed)
+        return response
+
+    def record(self, endpoint, method, status, elapsed, statements, db_time):
+        # also called by the ASGI fast path, which doesn't go through the hooks
+        key = (endpoint, method)
+        with self.lock:
+            status_key = key + (str(status),)
+            self.requests[status_key] = self.requests.get(status_key, 0) + 1
+            self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(elapsed)
+            self.statements.setdefault(key, Histogram(STATEMENT_BUCKETS)).observe(statements)
+            self.db_time.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(db_time)
+
+    def dump_profile(self, profiler, endpoint, elapsed):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        name = f"{endpoint}-{request.method}-{int(time.time() * 1000)}-{int(elapsed * 1000)}ms.prof"
+        profiler.dump_stats(os.path.join(self.profile_dir, name))
+
+    def render(self):
+        lines = []
+        with self.lock:
+            lines += ["# HELP api_requests_total Requests served, by endpoint, method and status.",
+                      "# TYPE api_requests_total counter"]
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'api_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+            for name, kind, metrics in (
+                ("api_request_duration_seconds", "Request latency.", self.latency),
+                ("api_db_statements_per_request", "SQL statements run per request.", self.statements),
+                ("api_db_time_seconds", "Time spent in SQL statements per request.", self.db_time),
+            ):
+                lines += [f"# HELP {name} {kind}", f"# TYPE {name} histogram"]
+                for (endpoint, method), histogram in sorted(metrics.items()):
+                    lines += histogram.lines(name, f'endpoint="{endpoint}",method="{method}"')
+
+        for collector in self.extra_collectors:
+            for name, kind, help_text, samples in collector():
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                for labels, value in samples:
+                    lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+        return "\n".join(lines) + "\n"
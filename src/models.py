@@ -1,15 +1,35 @@
+import os
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
 
 
 db = SQLAlchemy()
 
+# How the relationships used by serialize() are loaded: "selectin" (one extra
+# IN query per relationship) or "joined" (a single LEFT OUTER JOIN). Either way
+# list endpoints cost a constant number of queries instead of one per row.
+LOADING_STRATEGIES = ("selectin", "joined", "subquery")
+RELATIONSHIP_LOADING = os.getenv("RELATIONSHIP_LOADING", "selectin")
+if RELATIONSHIP_LOADING not in LOADING_STRATEGIES:
+    raise ValueError(f"RELATIONSHIP_LOADING must be one of {', '.join(LOADING_STRATEGIES)}")
+
+# Collation ordering strings by code point, where the database's default one
+# doesn't (SQLite's BINARY already does), for the name_prefix ranges
+CODE_POINT_COLLATIONS = {"postgresql": "C"}
+
 class Planets(db.Model):
     __tablename__ = "planets"
     id = db.Column(db.Integer, primary_key=True)
-    planet_name = db.Column(db.String(80), unique=False, nullable=False)
+    planet_name = db.Column(db.String(80), unique=False, nullable=False, index=True)
     gravity = db.Column(db.String(80), unique=False, nullable=False)
     diameter = db.Column(db.Integer, unique=False, nullable=False)
     rotation_period = db.Column(db.Integer, unique=False, nullable=False)
+    # Optimistic concurrency: every ORM UPDATE/DELETE is emitted with
+    # "WHERE version = <version read>" and bumps it, so a concurrent write
+    # makes the flush fail (StaleDataError, answered with 409) instead of being
+    # overwritten. Clients send the version back in If-Match.
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
 
     def __repr__(self):
         return f"Planeta {self.planet_name}"
@@ -21,17 +41,20 @@ class Planets(db.Model):
             "gravity" : self.gravity,
             "diameter": self.diameter,
             "rotation_period": self.rotation_period,
+            "version": self.version,
 
         }
     
 class Starships(db.Model):
     __tablename__ = "starships"
     id = db.Column(db.Integer, primary_key=True)
-    starship_name = db.Column(db.String(30), unique=False, nullable=False) 
+    starship_name = db.Column(db.String(30), unique=False, nullable=False, index=True)
     model = db.Column(db.String(30), unique=False, nullable=False)
-    starship_class = db.Column(db.String(30), unique=False, nullable=False)
+    starship_class = db.Column(db.String(30), unique=False, nullable=False, index=True)
     length = db.Column(db.String(30), unique=False, nullable=False)
     crew = db.Column(db.String(30), unique=False, nullable=False)
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
 
     def __repr__(self):
         return f"Nave {self.starship_name}"
@@ -44,20 +67,28 @@ class Starships(db.Model):
             "starship_class": self.starship_class,
             "length": self.length,
             "crew": self.crew,
+            "version": self.version,
      }   
 
 class Characters(db.Model):
     __tablename__ = "characters"
+    # foreign key filters are paginated by id, so id is the second column
+    __table_args__ = (
+        db.Index("ix_characters_planet_id", "planet_id", "id"),
+        db.Index("ix_characters_starship_id", "starship_id", "id"),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    character_name = db.Column(db.String(20), nullable=False)
+    character_name = db.Column(db.String(20), nullable=False, index=True)
     height = db.Column(db.Integer, nullable=False)
     mass = db.Column(db.Integer, nullable=False)
     hair_color = db.Column(db.String(20), nullable=False)
     skin_color = db.Column(db.String(20), nullable=False)
     planet_id = db.Column(db.Integer, db.ForeignKey("planets.id"), nullable=True)
-    planet = db.relationship(Planets)
+    planet = db.relationship(Planets, lazy=RELATIONSHIP_LOADING)
     starship_id = db.Column(db.Integer, db.ForeignKey("starships.id"), nullable=True)
-    starship = db.relationship(Starships)
+    starship = db.relationship(Starships, lazy=RELATIONSHIP_LOADING)
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
     favorites = db.relationship("Favorites", back_populates="character")
 
     def __repr__(self):
@@ -73,19 +104,51 @@ class Characters(db.Model):
             "hair_color": self.hair_color,
             "planet": self.planet.serialize() if self.planet else None,
             "starship": self.starship.serialize() if self.starship else None,
+            "version": self.version,
         }
 
+class CharacterCard(db.Model):
+    # Denormalized copy of Characters.serialize() (planet and starship included),
+    # kept up to date by cards.py (session events for ORM writes, the bulk
+    # endpoints for theirs) so the character GETs need neither joins nor
+    # nested serialization.
+    __tablename__ = "character_cards"
+    __table_args__ = (
+        db.Index("ix_character_cards_planet_id", "planet_id", "id"),
+        db.Index("ix_character_cards_starship_id", "starship_id", "id"),
+    )
+    # same id as the character, no foreign key so the card can be replaced in
+    # any order inside the write transaction
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    character_name = db.Column(db.String(20), nullable=False, index=True)
+    planet_id = db.Column(db.Integer, nullable=True)
+    starship_id = db.Column(db.Integer, nullable=True)
+    card = db.Column(db.JSON, nullable=False)
+
+    def __repr__(self):
+        return f"Card {self.character_name}"
+
+    def serialize(self):
+        return self.card
+
 class Favorites(db.Model):
     __tablename__ = "favorites"
+    __table_args__ = (
+        db.Index("ix_favorites_character_id", "character_id", "id"),
+        db.Index("ix_favorites_planet_id", "planet_id", "id"),
+        db.Index("ix_favorites_starship_id", "starship_id", "id"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     list_name = db.Column(db.String(30), unique=True, nullable=False) 
     character_id = db.Column(db.Integer, db.ForeignKey('characters.id'), nullable=False)
     planet_id = db.Column(db.Integer, db.ForeignKey('planets.id'), nullable=True)
     starship_id = db.Column(db.Integer, db.ForeignKey('starships.id'), nullable=True)
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
 
-    character = db.relationship("Characters")
-    planet = db.relationship("Planets")
-    starship = db.relationship("Starships")
+    character = db.relationship("Characters", lazy=RELATIONSHIP_LOADING)
+    planet = db.relationship("Planets", lazy=RELATIONSHIP_LOADING)
+    starship = db.relationship("Starships", lazy=RELATIONSHIP_LOADING)
 
     def __repr__(self):
         return f"{self.list_name}"
@@ -96,7 +159,8 @@ class Favorites(db.Model):
             "character": self.character.serialize() if self.character else None,
             "planet": self.planet.serialize() if self.planet else None,
             "starship": self.starship.serialize() if self.starship else None,
-            "id": self.id
+            "id": self.id,
+            "version": self.version,
         }
 
 class User(db.Model):
@@ -106,6 +170,8 @@ class User(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=True)
     password = db.Column(db.String(80), unique=False, nullable=True)
     is_active = db.Column(db.Boolean(), unique=False, nullable=True)
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
     favorites_id = db.Column(db.Integer, db.ForeignKey("favorites.id"))
     favorites = db.relationship(Favorites)
     
@@ -116,5 +182,66 @@ class User(db.Model):
             "id": self.id,
             "email": self.email,
             "username" : self.username,
+            "version": self.version,
             # do not serialize the password, its a security breach
-        }
\ No newline at end of file
+        }
+class UserFavorite(db.Model):
+    # One row per (user, favorited item). The unique index on
+    # (user_id, item_type, item_id) answers "is this favorited" and lists a
+    # user's favorites of one type without touching other users' rows; the
+    # (item_type, item_id) index finds the rows to drop when an item is deleted.
+    __tablename__ = "user_favorites"
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "item_type", "item_id", name="uq_user_favorites_item"),
+        db.Index("ix_user_favorites_item", "item_type", "item_id"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    # "character", "planet" or "starship"; no foreign key on item_id since it
+    # points at a different table depending on the type
+    item_type = db.Column(db.String(10), nullable=False)
+    item_id = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f"<UserFavorite {self.user_id} {self.item_type} {self.item_id}>"
+
+    def serialize(self):
+        return {
+            "type": self.item_type,
+            "id": self.item_id,
+        }
+
+class IdempotencyKey(db.Model):
+    # Outcome of a POST sent with an Idempotency-Key header, so a retry of the
+    # same request replays the stored response instead of writing again.
+    # status is NULL while the first request is still running.
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        db.UniqueConstraint("key", "scope", name="uq_idempotency_keys_key"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(255), nullable=False)
+    # "POST /characters": the same key may be used on different routes
+    scope = db.Column(db.String(255), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.Integer, nullable=True)
+    body = db.Column(db.LargeBinary, nullable=True)
+    mimetype = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.Float, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<IdempotencyKey {self.scope} {self.key}>"
+
+
+def code_point_index(table, column):
+    # name_prefix compares COLLATE "C" on Postgres, which the index= index of
+    # the column (in the database collation) can't serve
+    for dialect, collation in CODE_POINT_COLLATIONS.items():
+        event.listen(table, "after_create", DDL(
+            f'CREATE INDEX ix_{table.name}_{column}_c ON {table.name} ({column} COLLATE "{collation}")'
+        ).execute_if(dialect=dialect))
+
+code_point_index(Planets.__table__, "planet_name")
+code_point_index(Starships.__table__, "starship_name")
+code_point_index(Characters.__table__, "character_name")
+code_point_index(CharacterCard.__table__, "character_name")
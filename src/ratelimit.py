@@ -0,0 +1,139 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from flask import request, jsonify
+
+
+class BucketStore:
+    # Where the token buckets live. take() must be atomic over all the buckets
+    # it is given; a shared store (Redis, memcached...) implements the same
+    # method so every worker sees the same buckets.
+    def take(self, buckets, cost):
+        # buckets: [(key, rate, burst)]. Takes cost tokens (at most the burst
+        # of the bucket, so a full bucket always admits) from every bucket, or
+        # from none if any of them is short.
+        # -> 0 if the tokens were taken, else the seconds until they will be available
+        raise NotImplementedError
+
+
+class LocalBucketStore(BucketStore):
+    # Per-process buckets: {key: (tokens, updated_at)}, refilled lazily on
+    # access. The least recently used clients are dropped past max_keys, which
+    # only ever gives them a full bucket back.
+    def __init__(self, max_keys=10000, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, buckets, cost):
+        with self.lock:
+            now = self.clock()
+            levels = []
+            wait = 0.0
+            for key, rate, burst in buckets:
+                tokens, updated_at = self.buckets.pop(key, (burst, now))
+                tokens = min(burst, tokens + (now - updated_at) * rate)
+                needed = min(cost, burst)
+                if tokens < needed:
+                    wait = max(wait, (needed - tokens) / rate)
+                levels.append((key, tokens, needed))
+            for key, tokens, needed in levels:
+                self.buckets[key] = (tokens if wait else tokens - needed, now)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+            return wait
+
+    def __len__(self):
+        return len(self.buckets)
+
+
+class RateLimiter:
+    # Admission control in before_request, so a rejected request never opens a
+    # database session. Every client has one bucket refilled at RATE_LIMIT_RATE
+    # tokens per second up to RATE_LIMIT_BURST; a request takes as many tokens
+    # as its route costs (cost() decorator, overridden by RATE_LIMIT_COSTS),
+    # capped at the burst. RATE_LIMIT_ROUTES adds a bucket shared by all
+    # clients for some routes; a request is admitted only if both buckets
+    # have the tokens, and only then takes them from both.
+    def __init__(self, store=None):
+        self.store = store if store is not None else LocalBucketStore()
+        self.enabled = False
+        self.rate = 10.0
+        self.burst = 50.0
+        self.costs = {}
+        self.routes = {}
+        self.trust_proxy = False
+        self.limited = {}
+        self.app = None
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get("RATE_LIMIT_ENABLED", self.enabled)
+        self.rate = float(app.config.get("RATE_LIMIT_RATE", self.rate))
+        self.burst = float(app.config.get("RATE_LIMIT_BURST", self.burst))
+        self.costs = parse_pairs(app.config.get("RATE_LIMIT_COSTS"), float)
+        self.routes = parse_pairs(app.config.get("RATE_LIMIT_ROUTES"), parse_route_limit)
+        self.trust_proxy = app.config.get("RATE_LIMIT_TRUST_PROXY", self.trust_proxy)
+        app.extensions["rate_limiter"] = self
+        app.before_request(self.before_request)
+
+    @staticmethod
+    def cost(tokens):
+        # @limiter.cost(5) on a route; cost(0) exempts it
+        def decorator(view):
+            view.rate_limit_cost = tokens
+            return view
+        return decorator
+
+    def route_cost(self, endpoint):
+        if endpoint in self.costs:
+            return self.costs[endpoint]
+        view = self.app.view_functions.get(endpoint)
+        return getattr(view, "rate_limit_cost", 1)
+
+    def admit(self, client, endpoint):
+        # -> None if the request may run, else the Retry-After in seconds
+        if not self.enabled or endpoint is None:
+            return None
+        cost = self.route_cost(endpoint)
+        if cost <= 0:
+            return None
+        buckets = [(f"client:{client}", self.rate, self.burst)]
+        if endpoint in self.routes:
+            buckets.append((f"route:{endpoint}", *self.routes[endpoint]))
+        wait = self.store.take(buckets, cost)
+        if not wait:
+            return None
+        self.limited[endpoint] = self.limited.get(endpoint, 0) + 1
+        return max(1, math.ceil(wait))
+
+    def client_id(self):
+        if self.trust_proxy and request.access_route:
+            return request.access_route[0]
+        return request.remote_addr
+
+    def before_request(self):
+        retry_after = self.admit(self.client_id(), request.endpoint)
+        if retry_after is not None:
+            response = jsonify({"message": "Too many requests", "retry_after": retry_after})
+            response.status_code = 429
+            response.headers["Retry-After"] = str(retry_after)
+            return response
+        return None
+
+
+def parse_route_limit(value):
+    # "rate/burst", e.g. "20/100"
+    rate, _, burst = value.partition("/")
+    return float(rate), float(burst or rate)
+
+def parse_pairs(value, convert):
+    # "get_characters=10,get_planets=5" -> {"get_characters": 10.0, ...}
+    pairs = {}
+    for part in (value or "").split(","):
+        if part.strip():
+            name, _, setting = part.partition("=")
+            pairs[name.strip()] = convert(setting.strip())
+    return pairs
@@ -0,0 +1,124 @@
+from utils import APIException
+
+
+TYPE_NAMES = {int: "an integer", str: "a string", bool: "a boolean"}
+
+class Field:
+    def __init__(self, type, required=True, nullable=False, max_length=None):
+        self.type = type
+        self.required = required
+        self.nullable = nullable
+        self.max_length = max_length
+
+class Schema:
+    # Declarative description of a request body. The checks for every field are
+    # compiled into a flat list of closures when the schema is created (at import
+    # time), so validating a payload is a single pass that collects every error
+    # instead of stopping at the first one.
+    def __init__(self, name, **fields):
+        self.name = name
+        self.fields = fields
+        self.checks = [self.compile_field(field_name, field) for field_name, field in fields.items()]
+
+    @staticmethod
+    def compile_field(name, field):
+        expected = TYPE_NAMES[field.type]
+        # bool is a subclass of int, it must not pass as a number
+        reject_bool = field.type is not bool
+        max_length = field.max_length
+
+        def check(body, partial):
+            if name not in body:
+                if field.required and not partial:
+                    return f"{name} is required"
+                return None
+            value = body[name]
+            if value is None:
+                return None if field.nullable else f"{name} can't be null"
+            if not isinstance(value, field.type) or (reject_bool and isinstance(value, bool)):
+                return f"{name} must be {expected}"
+            if max_length is not None and len(value) > max_length:
+                return f"{name} must be at most {max_length} characters long"
+            return None
+        return check
+
+    def errors(self, body, partial=False, require_id=False):
+        if not isinstance(body, dict):
+            return ["body must be an object"]
+        errors = []
+        if require_id and (not isinstance(body.get("id"), int) or isinstance(body.get("id"), bool)):
+            errors.append("id is required and must be an integer")
+        for check in self.checks:
+            error = check(body, partial)
+            if error is not None:
+                errors.append(error)
+        return errors
+
+    def validate(self, body, partial=False, require_id=False):
+        # Raises before any session work happens, with every problem listed
+        if body is None:
+            raise APIException("You must send body information", status_code=400)
+        errors = self.errors(body, partial=partial, require_id=require_id)
+        if errors:
+            raise APIException(f"Invalid {self.name} information", status_code=400, payload={"errors": errors})
+        return body
+
+    def values(self, body):
+        return {name: body[name] for name in self.fields if name in body}
+
+
+user_schema = Schema(
+    "user",
+    username=Field(str, max_length=30),
+    email=Field(str, max_length=120),
+    password=Field(str, max_length=80),
+)
+
+user_update_schema = Schema(
+    "user",
+    username=Field(str, max_length=30),
+    email=Field(str, max_length=120),
+    password=Field(str, required=False, max_length=80),
+)
+
+character_schema = Schema(
+    "character",
+    character_name=Field(str, max_length=20),
+    hair_color=Field(str, max_length=20),
+    height=Field(int),
+    mass=Field(int),
+    skin_color=Field(str, max_length=20),
+    planet_id=Field(int, required=False, nullable=True),
+    starship_id=Field(int, required=False, nullable=True),
+)
+
+planet_schema = Schema(
+    "planet",
+    planet_name=Field(str, max_length=80),
+    gravity=Field(str, max_length=80),
+    diameter=Field(int),
+    rotation_period=Field(int),
+)
+
+starship_schema = Schema(
+    "starship",
+    starship_name=Field(str, max_length=30),
+    model=Field(str, max_length=30),
+    starship_class=Field(str, max_length=30),
+    length=Field(str, max_length=30),
+    crew=Field(str, max_length=30),
+)
+
+favorite_schema = Schema(
+    "favorite list",
+    list_name=Field(str, max_length=30),
+    character_id=Field(int),
+    planet_id=Field(int, nullable=True),
+    starship_id=Field(int, nullable=True),
+)
+
+user_favorite_schema = Schema(
+    "favorite",
+    type=Field(str, max_length=10),
+    id=Field(int),
+)
@@ -0,0 +1,223 @@
+import bisect
+import re
+import sqlite3
+import threading
+import time
+from sqlalchemy import text
+from models import db, Characters, Planets, Starships
+
+# type -> (model, name column, extra searchable columns, response cache namespace, rowid tag)
+SOURCES = {
+    "character": (Characters, "character_name", (), "characters", 1),
+    "planet": (Planets, "planet_name", (), "planets", 2),
+    "starship": (Starships, "starship_name", ("model",), "starships", 3),
+}
+
+def include_object(object, name, type_, reflected, compare_to):
+    # Alembic autogenerate filter: the FTS5 table (and its shadow tables) and
+    # the GIN indexes are created at runtime by ensure_ready(), not by the
+    # migrations, so they must not show up as tables/indexes to drop
+    if type_ == "table" and name.startswith("search_index"):
+        return False
+    if type_ == "index" and reflected and compare_to is None and name.endswith("_search"):
+        return False
+    return True
+
+def tokenize(query):
+    return re.findall(r"\w+", query.lower())
+
+
+class SQLiteFTSSearch:
+    # FTS5 table fed by triggers on the source tables, so every write path
+    # (handlers, bulk endpoints, admin, raw SQL) keeps it in sync. The rowid is
+    # id * 4 + tag, which lets the triggers replace a row without a scan.
+    name = "fts5"
+
+    def __init__(self):
+        self.ready = False
+        self.lock = threading.Lock()
+
+    def ensure_ready(self):
+        if self.ready:
+            return
+        with self.lock:
+            if self.ready:
+                return
+            db.session.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+                "kind UNINDEXED, ref_id UNINDEXED, name, model, prefix='2 3')"))
+            for kind, (model, name_column, extra, _, tag) in SOURCES.items():
+                table = model.__tablename__
+                values = (f"{{row}}.id * 4 + {tag}, '{kind}', {{row}}.id, {{row}}.{name_column}, "
+                          + (f"{{row}}.{extra[0]}" if extra else "''"))
+                insert = f"INSERT INTO search_index(rowid, kind, ref_id, name, model) VALUES ({values.format(row='new')});"
+                delete = f"DELETE FROM search_index WHERE rowid = old.id * 4 + {tag};"
+                synced = db.session.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = :name"),
+                    {"name": f"search_index_{table}_insert"}).first()
+                if synced:
+                    continue
+                # new index, or the table was recreated (which drops its triggers): reindex this type
+                db.session.execute(text(f"CREATE TRIGGER search_index_{table}_insert "
+                                        f"AFTER INSERT ON {table} BEGIN {insert} END"))
+                db.session.execute(text(f"CREATE TRIGGER search_index_{table}_update "
+                                        f"AFTER UPDATE ON {table} BEGIN {delete} {insert} END"))
+                db.session.execute(text(f"CREATE TRIGGER search_index_{table}_delete "
+                                        f"AFTER DELETE ON {table} BEGIN {delete} END"))
+                db.session.execute(text("DELETE FROM search_index WHERE kind = :kind"), {"kind": kind})
+                db.session.execute(text(f"INSERT INTO search_index(rowid, kind, ref_id, name, model) "
+                                        f"SELECT {values.format(row=table)} FROM {table}"))
+            db.session.commit()
+            self.ready = True
+
+    def search(self, tokens, limit, offset):
+        self.ensure_ready()
+        match = " ".join('"' + token + '"*' for token in tokens)
+        # bm25 column weights: kind, ref_id, name, model
+        rows = db.session.execute(text(
+            "SELECT kind, ref_id, name, bm25(search_index, 0.0, 0.0, 10.0, 1.0) AS rank FROM search_index "
+            "WHERE search_index MATCH :match ORDER BY rank, length(name), rowid LIMIT :limit OFFSET :offset"),
+            {"match": match, "limit": limit, "offset": offset})
+        return [{"type": row.kind, "id": row.ref_id, "name": row.name, "score": round(-row.rank, 6)} for row in rows]
+
+
+class PostgresSearch:
+    # tsvector expressions over the source tables, backed by GIN indexes on the
+    # same expressions, so there is nothing to keep in sync.
+    name = "postgres"
+
+    def __init__(self):
+        self.ready = False
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def document(kind):
+        _, name_column, extra, _, _ = SOURCES[kind]
+        columns = " || ' ' || ".join((name_column,) + extra)
+        return f"to_tsvector('simple', {columns})"
+
+    def ensure_ready(self):
+        if self.ready:
+            return
+        with self.lock:
+            if self.ready:
+                return
+            for kind, (model, _, _, _, _) in SOURCES.items():
+                table = model.__tablename__
+                db.session.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_search "
+                                        f"ON {table} USING gin ({self.document(kind)})"))
+            db.session.commit()
+            self.ready = True
+
+    def search(self, tokens, limit, offset):
+        self.ensure_ready()
+        selects = []
+        for kind, (model, name_column, _, _, _) in SOURCES.items():
+            document = self.document(kind)
+            selects.append(f"SELECT '{kind}' AS kind, id, {name_column} AS name, ts_rank({document}, query) AS rank "
+                           f"FROM {model.__tablename__}, query WHERE {document} @@ query")
+        sql = ("WITH query AS (SELECT to_tsquery('simple', :query) AS query) "
+               + " UNION ALL ".join(selects)
+               + " ORDER BY rank DESC, kind, id LIMIT :limit OFFSET :offset")
+        rows = db.session.execute(text(sql), {"query": " & ".join(f"{token}:*" for token in tokens),
+                                              "limit": limit, "offset": offset})
+        return [{"type": row.kind, "id": row.id, "name": row.name, "score": round(float(row.rank), 6)}
+                for row in rows]
+
+
+class MemorySearch:
+    # Fallback for other databases: an in-process prefix index (sorted token
+    # list + postings). A type is rebuilt from its table when the response
+    # cache version of that table changes, i.e. after a write handler of this
+    # process ran (or of any process, with a shared cache backend), and at
+    # least every SEARCH_REFRESH_SECONDS for the writes that don't bump it:
+    # other workers with per-process caches, the admin.
+    name = "memory"
+
+    def __init__(self, cache, refresh=60):
+        self.cache = cache
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        self.versions = {}
+        self.postings = {}
+        self.tokens = []
+        self.documents = {}
+
+    def ensure_ready(self):
+        for kind, (model, name_column, extra, namespace, _) in SOURCES.items():
+            version = (self.cache.version(namespace), int(time.time() // self.refresh))
+            if self.versions.get(kind) == version:
+                continue
+            columns = [model.id, getattr(model, name_column)] + [getattr(model, column) for column in extra]
+            rows = db.session.query(*columns).all()
+            with self.lock:
+                self.rebuild(kind, rows)
+                self.versions[kind] = version
+
+    def rebuild(self, kind, rows):
+        for key in [key for key in self.documents if key[0] == kind]:
+            name, tokens = self.documents.pop(key)
+            for token in tokens:
+                self.postings[token].discard(key)
+        for row in rows:
+            key = (kind, row[0])
+            tokens = set(tokenize(" ".join(value for value in row[1:] if value)))
+            self.documents[key] = (row[1], tokens)
+            for token in tokens:
+                self.postings.setdefault(token, set()).add(key)
+        self.postings = {token: keys for token, keys in self.postings.items() if keys}
+        self.tokens = sorted(self.postings)
+
+    def matches(self, prefix):
+        start = bisect.bisect_left(self.tokens, prefix)
+        end = bisect.bisect_right(self.tokens, prefix + "\uffff")
+        return self.tokens[start:end]
+
+    def search(self, tokens, limit, offset):
+        self.ensure_ready()
+        with self.lock:
+            scores = None
+            for query_token in tokens:
+                token_scores = {}
+                for token in self.matches(query_token):
+                    # a whole-word match ranks above a prefix match
+                    weight = 2.0 if token == query_token else 1.0
+                    for key in self.postings[token]:
+                        token_scores[key] = max(token_scores.get(key, 0.0), weight)
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {key: score + token_scores[key] for key, score in scores.items() if key in token_scores}
+            ranked = sorted((scores or {}).items(),
+                            key=lambda item: (-item[1], len(self.documents[item[0]][0]), item[0]))
+            return [{"type": kind, "id": ref_id, "name": self.documents[(kind, ref_id)][0], "score": score}
+                    for (kind, ref_id), score in ranked[offset:offset + limit]]
+
+
+def create_search_backend(app, db, cache):
+    choice = app.config.get("SEARCH_BACKEND", "auto")
+    with app.app_context():
+        dialect = db.engine.dialect.name
+    if choice == "auto":
+        if dialect == "sqlite" and fts5_available():
+            choice = "fts5"
+        elif dialect == "postgresql":
+            choice = "postgres"
+        else:
+            choice = "memory"
+    if choice == "fts5":
+        return SQLiteFTSSearch()
+    if choice == "postgres":
+        return PostgresSearch()
+    if choice == "memory":
+        return MemorySearch(cache, app.config.get("SEARCH_REFRESH_SECONDS", 60))
+    raise ValueError("SEARCH_BACKEND must be one of auto, fts5, postgres, memory")
+
+def fts5_available():
+    try:
+        connection = sqlite3.connect(":memory:")
+        connection.execute("CREATE VIRTUAL TABLE probe USING fts5(content)")
+        connection.close()
+        return True
+    except sqlite3.OperationalError:
+        return False
@@ -1,4 +1,13 @@
-from flask import jsonify, url_for
+import hashlib
+import re
+import threading
+import time
+from flask import jsonify, url_for, request, current_app, g, has_request_context, stream_with_context
+from sqlalchemy import event, orm
+from sqlalchemy.orm.util import identity_key
+from models import db, RELATIONSHIP_LOADING, CODE_POINT_COLLATIONS
+
+RULE_PARAMETER = re.compile(r"<(?:(\w+)(?:\([^)]*\))?:)?(\w+)>")
 
 class APIException(Exception):
     status_code = 400
@@ -15,13 +24,185 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+def setup_query_counter(app, db):
+    # Counts the SQL statements run while serving each request and the time
+    # spent in them (g.query_count, g.query_time). When MAX_QUERIES_PER_REQUEST
+    # is set (tests do this) any request that goes over the limit fails loudly,
+    # so N+1 regressions can't sneak back in.
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            g.query_count = g.get("query_count", 0) + 1
+            conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def time_query(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("query_started")
+        if started and has_request_context():
+            g.query_time = g.get("query_time", 0.0) + time.perf_counter() - started.pop()
+
+    @event.listens_for(engine, "handle_error")
+    def drop_failed_query(context):
+        if has_request_context() and context.connection is not None and context.connection.info.get("query_started"):
+            context.connection.info["query_started"].pop()
+
+    @app.after_request
+    def check_query_count(response):
+        limit = app.config.get("MAX_QUERIES_PER_REQUEST")
+        count = g.get("query_count", 0)
+        if limit is not None and count > int(limit):
+            raise AssertionError(f"{request.method} {request.path} ran {count} queries, the limit is {limit}")
+        return response
+
+def keyset_page(query, model):
+    # Cursor pagination on the primary key: ?limit=&after=<last id seen>.
+    # Filtering on id > after uses the PK index, so every page costs the same
+    # as the first one instead of an OFFSET scan.
+    max_limit = current_app.config.get("MAX_PAGE_SIZE", 1000)
+    limit = request.args.get("limit", current_app.config.get("PAGE_SIZE", 100), type=int)
+    if limit < 1 or limit > max_limit:
+        raise APIException(f"limit must be between 1 and {max_limit}", status_code=400)
+    after = request.args.get("after", type=int)
+    if after is not None:
+        query = query.filter(model.id > after)
+
+    items = query.order_by(model.id).limit(limit + 1).all()
+    next_url = None
+    if len(items) > limit:
+        items = items[:limit]
+        view_args = request.view_args or {}
+        # a query parameter named like a path argument (?user_id= on /user/<user_id>/...) can't be passed twice
+        args = {key: value for key, value in request.args.items() if key not in view_args}
+        args.update(limit=limit, after=items[-1].id)
+        next_url = url_for(request.endpoint, **view_args, **args)
+    return items, next_url
+
+def ids_arg():
+    # ?ids=3,1,2 -> [3, 1, 2] (duplicates dropped), None without the parameter
+    value = request.args.get("ids")
+    if value is None:
+        return None
+    try:
+        ids = list(dict.fromkeys(int(part) for part in value.split(",") if part.strip()))
+    except ValueError:
+        raise APIException("ids must be a comma separated list of integers", status_code=400)
+    max_ids = current_app.config.get("MAX_PAGE_SIZE", 1000)
+    if not ids or len(ids) > max_ids:
+        raise APIException(f"ids must list between 1 and {max_ids} ids", status_code=400)
+    return ids
+
+def get_many(query, model, ids):
+    # Multi-get: rows already in the session's identity map are reused, the
+    # rest come from one "id IN (...)" query. Returns the items in the order of
+    # ids and the ids that don't exist (or don't match the query's filters).
+    found = {}
+    if query.whereclause is None:
+        # a filtered query has to see every row, or filtered-out ones would be returned
+        for item_id in ids:
+            item = query.session.identity_map.get(identity_key(model, item_id))
+            if item is not None:
+                found[item_id] = item
+    remaining = [item_id for item_id in ids if item_id not in found]
+    if remaining:
+        found.update((item.id, item) for item in query.filter(model.id.in_(remaining)))
+    return [found[item_id] for item_id in ids if item_id in found], [item_id for item_id in ids if item_id not in found]
+
+def versioned(response_body, version, *related_versions):
+    # single-item GETs: ETag "<version>", or "<version>.<v1>.<v2>" when the body
+    # embeds other rows (None: no related row), so changing any of them changes
+    # the ETag. Sent back as is in If-Match, where only <version> is compared.
+    versions = [version, *related_versions]
+    response = jsonify(response_body)
+    response.set_etag(".".join("-" if version is None else str(version) for version in versions))
+    return response
+
+def etag_version(etag):
+    # "3", "3.1.2" (a character and its planet and starship) or "3.1.2-gzip"
+    # (compressed body) -> "3"
+    return etag.partition("-")[0].split(".")[0]
+
+def check_if_match(item):
+    # If-Match: "<version>" (the "version" field of the item) or the ETag of
+    # its single-item GET, whose first component is that version, on PUT/DELETE.
+    # Without the header the write still can't overwrite a concurrent one, the
+    # version check in the UPDATE catches that at flush time.
+    if request.if_match and not request.if_match.star_tag and \
+            str(item.version) not in {etag_version(etag) for etag in request.if_match.as_set()}:
+        raise APIException("This item was modified by another request", status_code=409,
+                           payload={"version": item.version})
+
+def prefix_upper_bound(prefix):
+    # smallest string above every string starting with prefix: "Lu" -> "Lv".
+    # Trailing U+10FFFF can't be incremented and is dropped ("a\U0010ffff" -> "b");
+    # None when nothing is left, i.e. no upper bound.
+    stripped = prefix.rstrip(chr(0x10FFFF))
+    if not stripped:
+        return None
+    return stripped[:-1] + chr(ord(stripped[-1]) + 1)
+
+def code_point_order(column, dialect):
+    # the column compared by code point, the order prefix_upper_bound assumes
+    collation = CODE_POINT_COLLATIONS.get(dialect)
+    return column if collation is None else column.collate(collation)
+
+def filter_query(query, **filters):
+    # Server-side filters from the query string, e.g.
+    # filter_query(query, planet_id=Characters.planet_id, name_prefix=Characters.character_name).
+    # name_prefix is turned into a range (name >= "Lu" AND name < "Lv") instead
+    # of LIKE so it can use the index on every database. The range only holds
+    # in code point order: on Postgres it is compared COLLATE "C" (en_US puts
+    # "lu" and "LU" between "Lu" and "Lv"), served by the *_c indexes.
+    for param, column in filters.items():
+        value = request.args.get(param)
+        if value is None or value == "":
+            continue
+        if param == "name_prefix":
+            column = code_point_order(column, db.engine.dialect.name)
+            query = query.filter(column >= value)
+            upper_bound = prefix_upper_bound(value)
+            if upper_bound is not None:
+                query = query.filter(column < upper_bound)
+            continue
+        if column.type.python_type is int:
+            try:
+                value = int(value)
+            except ValueError:
+                raise APIException(f"{param} must be an integer", status_code=400)
+        query = query.filter(column == value)
+    return query
+
+def wants_stream():
+    if request.args.get("stream") == "1":
+        return True
+    return request.accept_mimetypes.best_match(["application/json", "application/x-ndjson"]) == "application/x-ndjson"
+
+def stream_ndjson(query, model, serialize=None):
+    # Full-table export, one JSON object per line. yield_per fetches rows in
+    # batches from a server-side cursor and each row is encoded and sent as soon
+    # as it is serialized, so memory stays flat whatever the table size.
+    batch_size = current_app.config.get("STREAM_BATCH_SIZE", 500)
+    serialize = serialize or model.serialize
+    if RELATIONSHIP_LOADING == "subquery":
+        # subqueryload buffers every row, which yield_per refuses: selectin
+        # loads each batch's relationships with one IN query instead
+        query = query.options(orm.selectinload("*"))
+
+    def generate():
+        for item in query.order_by(model.id).yield_per(batch_size):
+            yield current_app.json.dumps(serialize(item)) + "\n"
+
+    return current_app.response_class(stream_with_context(generate()), mimetype="application/x-ndjson")
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
     return len(defaults) >= len(arguments)
 
-def generate_sitemap(app):
-    links = ['/admin/']
+def sitemap_links(app):
+    links = ['/admin/'] if app.config.get('ADMIN_MODE', 'eager') != 'off' else []
     for rule in app.url_map.iter_rules():
         # Filter out rules we can't navigate to in a browser
         # and rules that require parameters
@@ -29,8 +210,10 @@ def generate_sitemap(app):
             url = url_for(rule.endpoint, **(rule.defaults or {}))
             if "/admin/" not in url:
                 links.append(url)
+    return links
 
-    links_html = "".join(["<li><a href='" + y + "'>" + y + "</a></li>" for y in links])
+def generate_sitemap(app):
+    links_html = "".join(["<li><a href='" + y + "'>" + y + "</a></li>" for y in sitemap_links(app)])
     return """
         <div style="text-align: center;">
         <img style="max-height: 80px" src='https://storage.googleapis.com/breathecode/boilerplates/rigo-baby.jpeg' />
@@ -39,3 +222,52 @@ def generate_sitemap(app):
         <p>Start working on your proyect by following the <a href="https://start.4geeksacademy.com/starters/flask" target="_blank">Quick Start</a></p>
         <p>Remember to specify a real endpoint path like: </p>
         <ul style="text-align: left;">"""+links_html+"</ul></div>"
+
+def route_table(app):
+    # machine readable version of the sitemap: every rule with its methods and path parameters
+    routes = []
+    for rule in sorted(app.url_map.iter_rules(), key=lambda rule: (rule.rule, rule.endpoint)):
+        if rule.endpoint == "static" or rule.rule.startswith("/admin"):
+            continue
+        routes.append({
+            "endpoint": rule.endpoint,
+            "rule": rule.rule,
+            "methods": sorted(rule.methods - {"HEAD", "OPTIONS"}),
+            "parameters": [{"name": name, "type": converter or "string"}
+                           for converter, name in RULE_PARAMETER.findall(rule.rule)],
+        })
+    return routes
+
+
+class RouteIndex:
+    # The sitemap page and the JSON route table, built on the first request
+    # that needs them and then served from memory. Flask refuses new routes
+    # once the app has handled a request, so the table can't go stale after
+    # that; invalidate() is there for code that builds the app in steps.
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        self.built = None
+
+    def invalidate(self):
+        self.built = None
+
+    def get(self):
+        built = self.built
+        if built is None:
+            with self.lock:
+                if self.built is None:
+                    html = generate_sitemap(self.app).encode()
+                    routes = self.app.json.dumps({"routes": route_table(self.app)}).encode()
+                    self.built = {
+                        "html": (html, hashlib.sha1(html).hexdigest()),
+                        "json": (routes, hashlib.sha1(routes).hexdigest()),
+                    }
+                built = self.built
+        return built
+
+    def response(self, kind):
+        body, etag = self.get()[kind]
+        response = current_app.response_class(body, mimetype="text/html" if kind == "html" else "application/json")
+        response.set_etag(etag)
+        return response.make_conditional(request)
@@ -0,0 +1,252 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from flask import jsonify, url_for
+from sqlalchemy.exc import OperationalError
+from models import db
+from bulk import commit_or_conflict
+from utils import APIException
+
+JOB_COLUMNS = ("id", "kind", "state", "status_code", "result", "attempts", "created_at", "finished_at")
+
+
+class WriteQueue:
+    # Write-behind for writes nobody needs to read back right away (new users,
+    # favorites). A route validates its body and calls submit(kind, payload):
+    # with WRITE_BEHIND_ENABLED off the handler runs and commits in the request
+    # as before; with it on the job is stored in a local SQLite file, the
+    # request gets 202 and a status URL, and a worker thread applies up to
+    # WRITE_BEHIND_BATCH_SIZE jobs per transaction. The file stands in for a
+    # real broker: it is shared by the workers of one host, not across hosts.
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self.path = os.path.join(tempfile.gettempdir(), "write_behind.sqlite3")
+        self.max_pending = 10000
+        self.batch_size = 100
+        self.lease = 60.0
+        self.retention = 3600.0
+        self.start_worker = True
+        self.handlers = {}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.worker = None
+        self.worker_pid = None
+        self.applied = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get("WRITE_BEHIND_ENABLED", self.enabled)
+        self.path = app.config.get("WRITE_BEHIND_PATH") or self.path
+        self.max_pending = app.config.get("WRITE_BEHIND_MAX_PENDING", self.max_pending)
+        self.batch_size = app.config.get("WRITE_BEHIND_BATCH_SIZE", self.batch_size)
+        self.lease = app.config.get("WRITE_BEHIND_LEASE_SECONDS", self.lease)
+        self.retention = app.config.get("WRITE_BEHIND_RETENTION", self.retention)
+        # off: jobs are only applied by `flask write-behind-worker` in its own process
+        self.start_worker = app.config.get("WRITE_BEHIND_WORKER", "thread") == "thread"
+        app.extensions["write_queue"] = self
+        if self.enabled:
+            # started by the first request of each process (after gunicorn forks),
+            # which also resumes the jobs a previous process left queued
+            app.before_request(self.ensure_worker)
+
+    def handler(self, kind):
+        # @write_queue.handler("create_user") on a function(payload) -> (body, status)
+        # that writes through db.session without committing
+        def decorator(function):
+            self.handlers[kind] = function
+            return function
+        return decorator
+
+    def connection(self):
+        # one connection per thread (and per process, after a fork)
+        connection = getattr(self.local, "connection", None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS write_jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "kind TEXT NOT NULL, payload TEXT NOT NULL, state TEXT NOT NULL DEFAULT 'queued', "
+                "status_code INTEGER, result TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+                "created_at REAL NOT NULL, claimed_at REAL, finished_at REAL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_write_jobs_state ON write_jobs (state, id)")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def transaction(self, statements):
+        # statements(connection) runs inside BEGIN IMMEDIATE, so the check and
+        # the write of enqueue/claim are atomic across processes
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = statements(connection)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return result
+
+    def submit(self, kind, payload):
+        if not self.enabled:
+            body, status = self.handlers[kind](payload)
+            commit_or_conflict()
+            return jsonify(body), status
+
+        job_id = self.enqueue(kind, payload)
+        if job_id is None:
+            # backpressure: the worker is behind (or the database is down), don't accept more
+            self.rejected += 1
+            response = jsonify({"message": "Too many writes are waiting, try again later", "retry_after": 1})
+            response.status_code = 503
+            response.headers["Retry-After"] = "1"
+            return response
+        self.wake.set()
+        status_url = url_for("get_write_job", job_id=job_id)
+        response = jsonify({"msg": "The write has been queued", "job_id": job_id, "status_url": status_url})
+        response.status_code = 202
+        response.headers["Location"] = status_url
+        return response
+
+    def enqueue(self, kind, payload):
+        # -> the job id, or None if WRITE_BEHIND_MAX_PENDING jobs are already waiting
+        def insert(connection):
+            pending = connection.execute(
+                "SELECT count(*) FROM write_jobs WHERE state IN ('queued', 'running')").fetchone()[0]
+            if pending >= self.max_pending:
+                return None
+            return connection.execute(
+                "INSERT INTO write_jobs (kind, payload, created_at) VALUES (?, ?, ?)",
+                (kind, json.dumps(payload), time.time())).lastrowid
+        return self.transaction(insert)
+
+    def job(self, job_id):
+        row = self.connection().execute(
+            f"SELECT {', '.join(JOB_COLUMNS)} FROM write_jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(JOB_COLUMNS, row))
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def counts(self):
+        return dict(self.connection().execute("SELECT state, count(*) FROM write_jobs GROUP BY state"))
+
+    def claim(self):
+        # -> [(id, kind, payload)], oldest first. Jobs left running by a worker
+        # that died are handed out again once their lease is over, so a job is
+        # applied at least once.
+        def take(connection):
+            now = time.time()
+            connection.execute("UPDATE write_jobs SET state = 'queued' WHERE state = 'running' AND claimed_at < ?",
+                               (now - self.lease,))
+            jobs = connection.execute("SELECT id, kind, payload FROM write_jobs WHERE state = 'queued' "
+                                      "ORDER BY id LIMIT ?", (self.batch_size,)).fetchall()
+            connection.executemany("UPDATE write_jobs SET state = 'running', claimed_at = ?, attempts = attempts + 1 "
+                                   "WHERE id = ?", [(now, job_id) for job_id, _, _ in jobs])
+            return jobs
+        return self.transaction(take)
+
+    def finish(self, outcomes):
+        # outcomes: {job id: (body, status)}; finished jobs are kept WRITE_BEHIND_RETENTION seconds
+        def store(connection):
+            now = time.time()
+            connection.executemany(
+                "UPDATE write_jobs SET state = ?, status_code = ?, result = ?, finished_at = ? WHERE id = ?",
+                [("done" if status < 400 else "failed", status, json.dumps(body), now, job_id)
+                 for job_id, (body, status) in outcomes.items()])
+            connection.execute("DELETE FROM write_jobs WHERE state IN ('done', 'failed') AND finished_at < ?",
+                               (now - self.retention,))
+        self.transaction(store)
+        for _, status in outcomes.values():
+            if status < 400:
+                self.applied += 1
+            else:
+                self.failed += 1
+
+    def requeue(self, job_ids):
+        self.transaction(lambda connection: connection.executemany(
+            "UPDATE write_jobs SET state = 'queued' WHERE id = ?", [(job_id,) for job_id in job_ids]))
+
+    def apply(self, kind, payload):
+        return self.handlers[kind](json.loads(payload))
+
+    def flush(self):
+        # Applies one batch, -> the number of jobs claimed. The whole batch is
+        # one transaction; if any job in it fails, the batch is rolled back
+        # and every job runs in its own transaction so only that one fails.
+        # OperationalError (database down, locked, timed out) puts the jobs
+        # back in the queue and is raised for the worker to back off.
+        jobs = self.claim()
+        if not jobs:
+            return 0
+        with self.app.app_context():
+            try:
+                outcomes = {job_id: self.apply(kind, payload) for job_id, kind, payload in jobs}
+                db.session.commit()
+            except OperationalError:
+                db.session.rollback()
+                self.requeue([job_id for job_id, _, _ in jobs])
+                raise
+            except Exception:
+                db.session.rollback()
+                outcomes = {}
+                for position, (job_id, kind, payload) in enumerate(jobs):
+                    try:
+                        outcomes[job_id] = self.apply_alone(kind, payload)
+                    except OperationalError:
+                        self.finish(outcomes)
+                        self.requeue([job_id for job_id, _, _ in jobs[position:]])
+                        raise
+            finally:
+                db.session.remove()
+        self.finish(outcomes)
+        return len(jobs)
+
+    def apply_alone(self, kind, payload):
+        try:
+            outcome = self.apply(kind, payload)
+            commit_or_conflict()
+            return outcome
+        except APIException as error:
+            db.session.rollback()
+            return error.to_dict(), error.status_code
+        except OperationalError:
+            db.session.rollback()
+            raise
+        except Exception as error:
+            db.session.rollback()
+            self.app.logger.exception("write-behind job %s failed", kind)
+            return {"message": f"The write failed: {type(error).__name__}"}, 500
+
+    def run(self):
+        # the worker loop: woken by submit(), and every second to pick up jobs
+        # queued by other processes or whose lease ran out
+        backoff = 0.5
+        while True:
+            self.wake.wait(1.0)
+            self.wake.clear()
+            try:
+                while self.flush() == self.batch_size:
+                    pass
+                backoff = 0.5
+            except Exception:
+                self.app.logger.exception("write-behind flush failed, retrying in %.1fs", backoff)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+    def ensure_worker(self):
+        if not self.start_worker or (self.worker_pid == os.getpid() and self.worker.is_alive()):
+            return
+        with self.lock:
+            if self.worker is None or self.worker_pid != os.getpid() or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self.run, name="write-behind", daemon=True)
+                self.worker_pid = os.getpid()
+                self.worker.start()
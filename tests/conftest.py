@@ -0,0 +1,46 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "src"), os.path.join(ROOT, "benchmarks")]
+
+
+def pytest_addoption(parser):
+    # models.py picks the loader strategy at import time, so one test run
+    # covers one strategy (test_query_counts.py starts a run for the others)
+    parser.addoption("--relationship-loading", choices=("selectin", "joined", "subquery"), default="selectin")
+
+
+@pytest.fixture(scope="session")
+def relationship_loading(request):
+    return request.config.getoption("--relationship-loading")
+
+
+@pytest.fixture(scope="session")
+def app(relationship_loading):
+    # app.py reads its configuration at import time: a seeded SQLite file, the
+    # loader strategy under test and no response cache, so every request
+    # really runs its queries
+    os.environ["CACHE_ENABLED"] = "0"
+    os.environ["RELATIONSHIP_LOADING"] = relationship_loading
+    from seed import create_seeded_database
+    app, _ = create_seeded_database(f"sqlite:///{tempfile.mkdtemp()}/tests.db", 1000)
+    app.config["TESTING"] = True
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def max_queries(app):
+    # max_queries(n): requests running more than n statements raise AssertionError
+    def set_limit(limit):
+        app.config["MAX_QUERIES_PER_REQUEST"] = limit
+    yield set_limit
+    app.config["MAX_QUERIES_PER_REQUEST"] = None
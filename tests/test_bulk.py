@@ -0,0 +1,21 @@
+def character_body(client, character_id, **changes):
+    info = client.get(f"/characters/{character_id}").get_json()["character_info"]
+    body = {key: info[key] for key in ("id", "character_name", "height", "mass", "skin_color", "hair_color")}
+    return {**body, **changes}
+
+
+def test_the_same_id_twice_with_different_columns(client):
+    first = character_body(client, 1)
+    second = character_body(client, 2)
+    items = [
+        {**second, "height": second["height"] + 1},
+        {**first, "height": first["height"] + 1, "planet_id": 2},
+        {**first, "height": first["height"] + 2},
+    ]
+
+    response = client.put("/characters/bulk", json=items)
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()["updated"] == 3
+    info = client.get("/characters/1").get_json()["character_info"]
+    assert info["height"] == first["height"] + 2
+    assert info["planet"]["id"] == 2
@@ -0,0 +1,55 @@
+import pytest
+
+
+def character_with_planet(client):
+    for character_id in range(1, 50):
+        info = client.get(f"/characters/{character_id}").get_json()["character_info"]
+        if info["planet"] is not None:
+            return info
+    pytest.fail("no seeded character has a planet")
+
+
+def update_planet(client, planet):
+    body = {key: planet[key] for key in ("id", "planet_name", "gravity", "diameter", "rotation_period")}
+    body["diameter"] += 1
+    response = client.put("/planets", json=body)
+    assert response.status_code == 200, response.get_json()
+
+
+@pytest.mark.parametrize("query", ["", "?fields=id,character_name,planet"])
+def test_changing_the_planet_changes_the_character_etag(client, query):
+    info = character_with_planet(client)
+    path = f"/characters/{info['id']}{query}"
+    etag = client.get(path).headers["ETag"]
+    assert client.get(path, headers={"If-None-Match": etag}).status_code == 304
+
+    update_planet(client, info["planet"])
+
+    response = client.get(path, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_if_match_accepts_the_etag_of_the_get(client):
+    info = character_with_planet(client)
+    etag = client.get(f"/characters/{info['id']}").headers["ETag"]
+    body = {key: info[key] for key in ("id", "character_name", "height", "mass", "skin_color", "hair_color")}
+
+    body["height"] += 1
+    response = client.put("/characters", json=body, headers={"If-Match": etag})
+    assert response.status_code == 200
+    # the character's version moved on, the old ETag no longer matches
+    body["height"] += 1
+    response = client.put("/characters", json=body, headers={"If-Match": etag})
+    assert response.status_code == 409
+
+
+def test_compressed_bodies_get_their_own_etag(client):
+    compressed = client.get("/routes", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    plain = client.get("/routes", headers={"Accept-Encoding": "identity"})
+    assert compressed.headers["ETag"] != plain.headers["ETag"]
+
+    etag = compressed.headers["ETag"]
+    assert client.get("/routes", headers={"Accept-Encoding": "gzip", "If-None-Match": etag}).status_code == 304
+    assert client.get("/routes", headers={"Accept-Encoding": "identity", "If-None-Match": etag}).status_code == 200
@@ -0,0 +1,30 @@
+from sqlalchemy.dialects import postgresql
+
+
+def names_with_prefix(client, prefix):
+    names = []
+    path = f"/characters?fields=id,character_name&limit=500&name_prefix={prefix}"
+    while path:
+        body = client.get(path).get_json()
+        names.extend(character["character_name"] for character in body["characters"])
+        path = body["next"]
+    return names
+
+
+def test_name_prefix_is_case_sensitive(client):
+    for name in ("luke lower", "LUKE UPPER", "Lv after"):
+        response = client.post("/characters", json={
+            "character_name": name, "hair_color": "none", "height": 1, "mass": 1, "skin_color": "none"})
+        assert response.status_code == 201
+
+    names = names_with_prefix(client, "Lu")
+    assert names
+    assert all(name.startswith("Lu") for name in names)
+
+
+def test_name_prefix_compares_by_code_point_on_postgres(app):
+    from models import Characters
+    from utils import code_point_order
+    column = code_point_order(Characters.character_name, "postgresql")
+    assert 'COLLATE "C"' in str((column >= "Lu").compile(dialect=postgresql.dialect()))
+    assert code_point_order(Characters.character_name, "sqlite") is Characters.character_name
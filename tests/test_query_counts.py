@@ -0,0 +1,51 @@
+import subprocess
+import sys
+
+import pytest
+
+# (path, {strategy: statements}) for a page of any size: with selectin and
+# subquery one SELECT for the rows plus one query per relationship
+# serialize() reaches, with joined a single SELECT
+LIST_ROUTES = [
+    ("/characters", {"selectin": 1, "joined": 1, "subquery": 1}),
+    ("/characters?fields=id,character_name,planet,starship", {"selectin": 3, "joined": 1, "subquery": 3}),
+    ("/favorites", {"selectin": 6, "joined": 1, "subquery": 6}),
+    ("/favorites?fields=id,character.planet", {"selectin": 3, "joined": 1, "subquery": 3}),
+]
+
+
+@pytest.mark.parametrize("path,statements", LIST_ROUTES)
+@pytest.mark.parametrize("limit", [10, 100, 500])
+def test_list_routes_run_a_fixed_number_of_queries(client, max_queries, relationship_loading, path, statements, limit):
+    max_queries(statements[relationship_loading])
+    separator = "&" if "?" in path else "?"
+    response = client.get(f"{path}{separator}limit={limit}")
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("path,statements", LIST_ROUTES)
+def test_next_pages_cost_the_same(client, max_queries, relationship_loading, path, statements):
+    max_queries(statements[relationship_loading])
+    separator = "&" if "?" in path else "?"
+    response = client.get(f"{path}{separator}limit=50")
+    assert response.status_code == 200
+    response = client.get(response.get_json()["next"])
+    assert response.status_code == 200
+
+
+def test_going_over_the_limit_fails(client, max_queries, relationship_loading):
+    statements = dict(LIST_ROUTES)["/favorites"][relationship_loading]
+    max_queries(statements - 1)
+    with pytest.raises(AssertionError, match=f"ran {statements} queries, the limit is {statements - 1}"):
+        client.get("/favorites?limit=10")
+
+
+@pytest.mark.parametrize("strategy", ["joined", "subquery"])
+def test_other_loading_strategies(relationship_loading, strategy):
+    if relationship_loading != "selectin":
+        pytest.skip("started from the selectin run")
+    result = subprocess.run(
+        [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", __file__,
+         "--relationship-loading", strategy, "-k", "not test_other_loading_strategies"],
+        capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout + result.stderr
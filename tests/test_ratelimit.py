@@ -0,0 +1,15 @@
+from ratelimit import LocalBucketStore
+
+
+def test_a_cost_above_the_burst_is_admitted_on_a_full_bucket():
+    store = LocalBucketStore(clock=lambda: 0.0)
+    assert store.take([("client:a", 1.0, 10.0)], 20) == 0
+    assert store.take([("client:a", 1.0, 10.0)], 20) == 10.0
+
+
+def test_a_refused_request_takes_from_no_bucket():
+    store = LocalBucketStore(clock=lambda: 0.0)
+    assert store.take([("route:bulk", 1.0, 2.0)], 2) == 0
+    # the route bucket is empty: the client's must stay full
+    assert store.take([("client:a", 1.0, 5.0), ("route:bulk", 1.0, 2.0)], 2) == 2.0
+    assert store.buckets["client:a"] == (5.0, 0.0)
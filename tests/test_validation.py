@@ -0,0 +1,50 @@
+import threading
+
+import pytest
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"data": "not json", "content_type": "text/plain"},
+    {"json": ["a", "list"]},
+    {"json": {"list_name": 5}},
+])
+def test_updating_a_favorite_list_validates_the_body(client, kwargs):
+    response = client.put("/favorites/1", **kwargs)
+    assert response.status_code == 400
+    assert response.is_json
+
+
+def test_updating_a_favorite_list(client):
+    response = client.put("/favorites/1", json={"planet_id": 2})
+    assert response.status_code == 200
+    info = client.get("/favorites/1").get_json()["favorite_list_info"]
+    assert info["planet"]["id"] == 2
+
+
+@pytest.fixture
+def write_behind(app, monkeypatch, tmp_path):
+    # jobs are queued but never applied: no worker thread
+    queue = app.extensions["write_queue"]
+    monkeypatch.setattr(queue, "enabled", True)
+    monkeypatch.setattr(queue, "start_worker", False)
+    monkeypatch.setattr(queue, "path", str(tmp_path / "write_behind.sqlite3"))
+    monkeypatch.setattr(queue, "local", threading.local())
+    return queue
+
+
+@pytest.mark.parametrize("method", ["post", "delete"])
+@pytest.mark.parametrize("path,body,status", [
+    ("/user/1/favorites", [{"type": "spaceship", "id": 1}], 400),
+    ("/user/1/favorites", {"type": "planet", "id": 1}, 400),
+    ("/user/999999/favorites", [{"type": "planet", "id": 1}], 404),
+])
+def test_user_favorites_are_validated_before_they_are_queued(client, write_behind, method, path, body, status):
+    response = getattr(client, method)(path, json=body)
+    assert response.status_code == status
+    assert write_behind.counts() == {}
+
+
+def test_valid_user_favorites_are_queued(client, write_behind):
+    response = client.post("/user/1/favorites", json=[{"type": "planet", "id": 1}])
+    assert response.status_code == 202
+    assert write_behind.counts() == {"queued": 1}